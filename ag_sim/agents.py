@@ -5,46 +5,20 @@ from queue import PriorityQueue
 import astar
 from copy import deepcopy
 from multiprocessing import Pool
-from random import seed
-from random import randint
-from datetime import datetime
+import numpy
+from ag_sim.targeting import rankTargets, fieldUrgency, stateLimits
+from ag_sim.states import TOOLS, TOOL_IDS, TOOL_MASKS, NO_TOOL_MASK
+from ag_sim.events import SICK, WEEDS
 
 # Heuristic needed for movement cost to the goal
+# The columns are only connected through the headland rows of the layout (see ag_sim/layout.py)
 
 
-def distance(a, b):
+def distance(a, b, headlands=(0, 49)):
     v1 = abs(a[0]-b[0])
     if v1 == 1:
-        temp = v1 + abs(a[1]-b[1])
-    else:
-        temp1 = v1 + abs(0-a[1]) + abs(0-b[1])
-        temp2 = v1 + abs(49-a[1]) + abs(49-b[1])
-        temp = min(temp1, temp2)
-
-    return temp
-
-
-# Using this function for adding an element in the "queue" at the appropriate position
-def prioritizeQueue(queue, element):
-    check = 0
-    while check == 0:
-        length = len(queue)
-        if length == 0:
-            queue.insert(0, element)
-            break
-        else:
-            while length >= 0:
-                length -= 1
-                if element[0] > queue[length][0]:
-                    queue.insert(length+1, element)
-                    check = 1
-                    break
-
-        if check == 0:
-            queue.insert(0, element)
-            break
-
-    return queue
+        return v1 + abs(a[1]-b[1])
+    return v1 + min([abs(row-a[1]) + abs(row-b[1]) for row in headlands])
 
 
 '''
@@ -96,6 +70,29 @@ class PassiveAgentStateMachine(StateMachine):
     waterable_states = (seed, seed_sick, seed_weeds, growing, growing_sick,
                         growing_weeds, flowering, flowering_sick, flowering_weeds)
 
+    # The PassiveAgent owning the machine is told about every state change
+    def __init__(self, agent=None):
+        self.agent = agent
+        super().__init__()
+
+    def on_enter_state(self, state):
+        if self.agent is not None:
+            self.agent.stateChanged(state)
+
+    # StateMachine.check validates the graph of the states for every machine; it is the same for all machines,
+    # so it is only done for the first one and the others only get the initial state
+    checkedInitial = None
+
+    def check(self):
+        cls = type(self)
+        if cls.checkedInitial is None:
+            super().check()
+            cls.checkedInitial = self.initial_state
+            return
+        self.initial_state = cls.checkedInitial
+        if self.current_state_value is None:
+            self.current_state_value = self.initial_state.value
+
     # All possible transitions of a soil patch
     # Start state transitions
     plow = start.to(plowed)
@@ -162,6 +159,52 @@ class PassiveAgentStateMachine(StateMachine):
 '''
 
 
+# Attributes of a new PassiveAgent (the state times and counters, and the crop parameters of model_params)
+def fieldAttributes(model_params):
+    return {
+        # State times that need to be saved (the properties are mirrored in the knowledge map, where they start at 0)
+        "_time_at_current_state": 0,
+        "time_at_prev_healthy_state": 0,
+        "steps_in_dehydrated_state": 0,
+        "steps_in_sick_state": 0,
+        "steps_in_weeds_state": 0,
+
+        "_taken": 0,
+
+        # Set back a state some steps as a penalty <-- currently not used (set to 0)
+        "penalty_for_dry_sick_weeds": 0,
+
+        # Number of steps that a crop can live without getting dehydrated
+        "water_level": 0,
+        "max_steps_dehydrated": model_params["max_steps_dehydrated"],
+        "max_water_level": model_params["max_water_level"],
+
+        # Maximum number of steps in sick and weeds states
+        "max_steps_sick": model_params["max_steps_sick"],
+        "max_steps_weeds": model_params["max_steps_weeds"],
+
+        # Seed crop parameters
+        "seed_sick_probability": model_params["seed_sick_probability"],
+        "seed_weeds_probability": model_params["seed_weeds_probability"],
+        "steps_seed_to_growing": model_params["steps_seed_to_growing"],
+
+        # Growing crop parameters
+        "growing_sick_probability": model_params["growing_sick_probability"],
+        "growing_weeds_probability": model_params["growing_weeds_probability"],
+        "steps_growing_to_flowering": model_params["steps_growing_to_flowering"],
+
+        # Flowering crop parameters
+        "flowering_sick_probability": model_params["flowering_sick_probability"],
+        "flowering_weeds_probability": model_params["flowering_weeds_probability"],
+        "steps_flowering_to_harvestable": model_params["steps_flowering_to_harvestable"],
+
+        # Harvestable crop parameters
+        "harvestable_sick_probability": model_params["harvestable_sick_probability"],
+        "harvestable_weeds_probability": model_params["harvestable_weeds_probability"],
+        "steps_harvestable_to_dead": model_params["steps_harvestable_to_dead"],
+    }
+
+
 class PassiveAgent(Agent):
     grid = None
     x = None
@@ -182,51 +225,45 @@ class PassiveAgent(Agent):
     '''
 
     def __init__(self, unique_id, pos, model, **model_params):
-        super().__init__(unique_id, model)
+        self.machine = PassiveAgentStateMachine(self)
+        self.initField(unique_id, pos, model, model.knowledgeMap.fieldIndexAt[pos], fieldAttributes(model_params))
+        self.knowledge.registerField(self)
+
+    # Initialization shared by the constructor and createFields (the field is registered by the caller)
+    def initField(self, unique_id, pos, model, fieldIndex, attributes):
+        Agent.__init__(self, unique_id, model)
         self.pos = pos
         self.agent_type = 'PASSIVE'
-        self.machine = PassiveAgentStateMachine()
-
-        # State times that need to be saved
-        self.time_at_current_state = 0
-        self.time_at_prev_healthy_state = 0
-        self.steps_in_dehydrated_state = 0
-        self.steps_in_sick_state = 0
-        self.steps_in_weeds_state = 0
-
-        self.taken = 0
-
-        # Set back a state some steps as a penalty <-- currently not used (set to 0)
-        self.penalty_for_dry_sick_weeds = 0
-
-        # Number of steps that a crop can live without getting dehydrated
-        self.water_level = 0
-        self.max_steps_dehydrated = model_params["max_steps_dehydrated"]
-        self.max_water_level = model_params["max_water_level"]
-
-        # Maximum number of steps in sick and weeds states
-        self.max_steps_sick = model_params["max_steps_sick"]
-        self.max_steps_weeds = model_params["max_steps_weeds"]
 
-        # Set passive agent's seed crop parameters
-        self.seed_sick_probability = model_params["seed_sick_probability"]
-        self.seed_weeds_probability = model_params["seed_weeds_probability"]
-        self.steps_seed_to_growing = model_params["steps_seed_to_growing"]
+        # Index of this field in the field arrays of the AgentKnowledgeMap
+        self.knowledge = model.knowledgeMap
+        self.fieldIndex = fieldIndex
 
-        # Set passive agent's growing crop parameters
-        self.growing_sick_probability = model_params["growing_sick_probability"]
-        self.growing_weeds_probability = model_params["growing_weeds_probability"]
-        self.steps_growing_to_flowering = model_params["steps_growing_to_flowering"]
+        self.__dict__.update(attributes)
 
-        # Set passive agent's flowering crop parameters
-        self.flowering_sick_probability = model_params["flowering_sick_probability"]
-        self.flowering_weeds_probability = model_params["flowering_weeds_probability"]
-        self.steps_flowering_to_harvestable = model_params["steps_flowering_to_harvestable"]
+    '''
+    *** createFields creates the PassiveAgents of all field positions at once (unique ids in the order of the positions)
+    *** The field arrays are filled in one go (AgentKnowledgeMap.registerFields) and the attributes that depend on the
+        model parameters are computed once for all fields
+    *** recycled: PassiveAgents of a previous run of the model (see AgSimulator.reset); those on the same positions
+        are reinitialized instead of created
+    '''
 
-        # Set passive agent's harvestable crop parameters
-        self.harvestable_sick_probability = model_params["harvestable_sick_probability"]
-        self.harvestable_weeds_probability = model_params["harvestable_weeds_probability"]
-        self.steps_harvestable_to_dead = model_params["steps_harvestable_to_dead"]
+    @classmethod
+    def createFields(cls, model, positions, recycled=(), **model_params):
+        attributes = fieldAttributes(model_params)
+        agents = list()
+        for index, pos in enumerate(positions):
+            if index < len(recycled) and recycled[index].pos == pos:
+                agent = recycled[index]
+                agent.machine.current_state_value = agent.machine.initial_state.value
+            else:
+                agent = cls.__new__(cls)
+                agent.machine = PassiveAgentStateMachine(agent)
+            agent.initField(model.next_id(), pos, model, index, attributes)
+            agents.append(agent)
+        model.knowledgeMap.registerFields(agents)
+        return agents
 
     '''
     *** Main interaction function between ActiveAgent and PassiveAgent
@@ -235,6 +272,38 @@ class PassiveAgent(Agent):
     *** Interaction functions defined below (subject to change)
     '''
 
+    '''
+    *** time_at_current_state and taken are mirrored in the field arrays of the AgentKnowledgeMap
+    *** so that ActiveAgents can score all fields at once
+    '''
+
+    @property
+    def time_at_current_state(self):
+        return self._time_at_current_state
+
+    @time_at_current_state.setter
+    def time_at_current_state(self, value):
+        self._time_at_current_state = value
+        self.knowledge.updateFieldTime(self.fieldIndex, value)
+
+    @property
+    def taken(self):
+        return self._taken
+
+    @taken.setter
+    def taken(self, value):
+        self._taken = value
+        self.knowledge.updateFieldTaken(self.fieldIndex, value)
+
+    def stateChanged(self, state):
+        self.knowledge.updateField(self.fieldIndex, state)
+
+    # Random number for a crop event (SICK or WEEDS), from the common crop event stream if the model has one (see ag_sim/events.py)
+    def eventDraw(self, event):
+        if self.model.cropEvents is None:
+            return self.random.random()
+        return self.model.cropEvents.draw(self.model.schedule.steps, self.fieldIndex, event)
+
     def interact(self, agent):
         if (agent.agent_type == 'ACTIVE'):
             switcher = {'plow': self.plow, 'seeder': self.sow, 'sprayer': self.cure, 'wacker': self.kill_weeds,
@@ -423,12 +492,12 @@ class PassiveAgent(Agent):
             self.time_at_current_state = 0
             self.machine.dry_seed()
         # Randomly get sick
-        elif (self.random.random() < self.seed_sick_probability):
+        elif (self.eventDraw(SICK) < self.seed_sick_probability):
             self.time_at_prev_healthy_state = self.time_at_current_state
             self.time_at_current_state = 0
             self.machine.sick_seed()
         # Randomly get weeds
-        elif (self.random.random() < self.seed_weeds_probability):
+        elif (self.eventDraw(WEEDS) < self.seed_weeds_probability):
             self.time_at_prev_healthy_state = self.time_at_current_state
             self.time_at_current_state = 0
             self.machine.weeds_seed()
@@ -444,12 +513,12 @@ class PassiveAgent(Agent):
             self.time_at_current_state = 0
             self.machine.dry_growing()
         # Randomly get sick
-        elif (self.random.random() < self.growing_sick_probability):
+        elif (self.eventDraw(SICK) < self.growing_sick_probability):
             self.time_at_prev_healthy_state = self.time_at_current_state
             self.time_at_current_state = 0
             self.machine.sick_growing()
         # Randomly get weeds
-        elif (self.random.random() < self.growing_weeds_probability):
+        elif (self.eventDraw(WEEDS) < self.growing_weeds_probability):
             self.time_at_prev_healthy_state = self.time_at_current_state
             self.time_at_current_state = 0
             self.machine.weeds_growing()
@@ -465,12 +534,12 @@ class PassiveAgent(Agent):
             self.time_at_current_state = 0
             self.machine.dry_flowering()
         # Randomly get sick
-        elif (self.random.random() < self.flowering_sick_probability):
+        elif (self.eventDraw(SICK) < self.flowering_sick_probability):
             self.time_at_prev_healthy_state = self.time_at_current_state
             self.time_at_current_state = 0
             self.machine.sick_flowering()
         # Randomly get weeds
-        elif (self.random.random() < self.flowering_weeds_probability):
+        elif (self.eventDraw(WEEDS) < self.flowering_weeds_probability):
             self.time_at_prev_healthy_state = self.time_at_current_state
             self.time_at_current_state = 0
             self.machine.weeds_flowering()
@@ -486,12 +555,12 @@ class PassiveAgent(Agent):
             self.time_at_current_state = 0
             self.machine.dry_harvestable()
         # Randomly get sick
-        elif (self.random.random() < self.harvestable_sick_probability):
+        elif (self.eventDraw(SICK) < self.harvestable_sick_probability):
             self.time_at_prev_healthy_state = self.time_at_current_state
             self.time_at_current_state = 0
             self.machine.sick_harvestable()
         # Randomly get weeds
-        elif (self.random.random() < self.harvestable_weeds_probability):
+        elif (self.eventDraw(WEEDS) < self.harvestable_weeds_probability):
             self.time_at_prev_healthy_state = self.time_at_current_state
             self.time_at_current_state = 0
             self.machine.weeds_harvestable()
@@ -661,6 +730,14 @@ class ActiveAgent(Agent):
         self.fieldsToAttend = list()
         self.recalculateHeur = 0
         self.search = 0
+        self.stateLimits = stateLimits(model_params["max_steps_dehydrated"],
+                                       model_params["max_steps_weeds"], model_params["max_steps_sick"])
+
+        # Fields that can be attended with the current tool, kept up to date through the AgentKnowledgeMap subscription
+        self._current_tool = None
+        self.targetSet = set()
+        self.targets = numpy.zeros(0, dtype=int)
+        self.targetsChanged = False
 
         if self.protocol == "Coordination Cooperative protocol":
             self.coordinationCheck = 0
@@ -679,6 +756,36 @@ class ActiveAgent(Agent):
         elif self.protocol == "Helper-Based protocol" or self.protocol == "Simple protocol":
             self.current_tool = 'plow'
 
+    '''
+    *** Changing current_tool renews the subscription of the agent to the AgentKnowledgeMap,
+    *** so it is only notified about the fields in the states its tool can attend
+    '''
+
+    @property
+    def current_tool(self):
+        return self._current_tool
+
+    @current_tool.setter
+    def current_tool(self, tool):
+        if tool == self._current_tool:
+            return
+        self._current_tool = tool
+        knowledge = self.model.knowledgeMap
+        knowledge.unsubscribe(self)
+        self.targetSet = set()
+        if tool is not None:
+            self.targetSet.update(knowledge.subscribe(
+                self, TOOL_MASKS.get(tool, NO_TOOL_MASK)).tolist())
+        self.targetsChanged = True
+
+    def fieldEntered(self, index):
+        self.targetSet.add(index)
+        self.targetsChanged = True
+
+    def fieldLeft(self, index):
+        self.targetSet.discard(index)
+        self.targetsChanged = True
+
     # Add what the agent sees to the knowledgeMap
 
     def update_perception(self, perceptionRadius=5):
@@ -701,47 +808,68 @@ class ActiveAgent(Agent):
         else:
             self.target = None
 
-    # This function calculates the heuristic based on the distance of the field to the agent (calculated using A*)
-    # and based on the field's state
-
-    def heuristic(self, pointOfInterest, distance):
-        value = 0
-        special = 0
-        if pointOfInterest.machine.current_state.value == "start":
-            value += distance
-        elif pointOfInterest.machine.current_state.value == "plowed":
-            value += distance
-        elif pointOfInterest.machine.current_state.value == "seed_dry" or pointOfInterest.machine.current_state.value == "growing_dry" or pointOfInterest.machine.current_state.value == "flowering_dry" or pointOfInterest.machine.current_state.value == "harvestable_dry":
-            value += 1*((pointOfInterest.time_at_current_state + distance) /
-                        pointOfInterest.max_steps_dehydrated)*(1-pointOfInterest.taken)
-            special = 1
-        elif pointOfInterest.machine.current_state.value == "seed_weeds" or pointOfInterest.machine.current_state.value == "growing_weeds" or pointOfInterest.machine.current_state.value == "flowering_weeds" or pointOfInterest.machine.current_state.value == "harvestable_weeds":
-            value += 1*((pointOfInterest.time_at_current_state + distance) /
-                        pointOfInterest.max_steps_weeds)*(1-pointOfInterest.taken)
-            special = 1
-        elif pointOfInterest.machine.current_state.value == "seed_sick" or pointOfInterest.machine.current_state.value == "growing_sick" or pointOfInterest.machine.current_state.value == "flowering_sick" or pointOfInterest.machine.current_state.value == "harvestable_sick":
-            value += 1*((pointOfInterest.time_at_current_state + distance) /
-                        pointOfInterest.max_steps_sick)*(1-pointOfInterest.taken)
-            special = 1
-        elif pointOfInterest.machine.current_state.value == "harvestable":
-            value = distance
-
-        if value > 1 and special == 1:
-            return 999
-        else:
-            return value
-
     # Recalculate the heuristic based on current items to attend
 
     def recalculateHeuristics(self):
         if len(self.fieldsToAttend) > 0:
-            queue = list()
-            for element in self.fieldsToAttend:
-                queue = prioritizeQueue(
-                    queue, (distance(element[1].pos, self.pos), element[1]))
-
-            self.fieldsToAttend.clear()
-            self.fieldsToAttend = queue
+            headlands = self.model.layout.headlands
+            distances = [distance(element[1].pos, self.pos, headlands)
+                         for element in self.fieldsToAttend]
+            self.fieldsToAttend = [(distances[index], self.fieldsToAttend[index][1])
+                                   for index in rankTargets(distances)]
+
+    # Collect the fields from the KnowledgeMap that can be attended with the current tool
+    # Returns their field indices and their scores (lower is better, see targeting.fieldUrgency)
+    # The score is based on the distance of the field to the agent and on the field's state
+    # The candidate fields come from the subscription, so only the changes since the last call are processed
+
+    def candidateTargets(self):
+        if self.targetsChanged:
+            self.targets = numpy.array(sorted(self.targetSet), dtype=int)
+            self.targetsChanged = False
+        candidates = self.targets
+        if len(candidates) == 0:
+            return candidates, numpy.zeros(0)
+        knowledge = self.model.knowledgeMap
+        scores = fieldUrgency(knowledge.stateCodes[candidates], knowledge.stateTimes[candidates],
+                              knowledge.taken[candidates], knowledge.fieldPositions[candidates], self.pos, self.stateLimits,
+                              self.model.layout.headlands)
+        return candidates, scores
+
+    # Position in candidates of the best candidate that is not taken by another agent (None if all are taken)
+
+    def bestFreeTarget(self, candidates, scores):
+        free = numpy.flatnonzero(
+            self.model.knowledgeMap.taken[candidates] == 0)
+        if len(free) == 0:
+            return None
+        return free[rankTargets(scores[free], 1)[0]]
+
+    # Position in candidates of the target to go to: the field assigned by the central allocator if there is one,
+    # otherwise the best free candidate
+
+    def chooseTarget(self, candidates, scores):
+        if self.model.allocator is None:
+            return self.bestFreeTarget(candidates, scores)
+        return self.model.allocator.assignedTarget(self, candidates)
+
+    # Take the best candidate and all free candidates on the given columns, and add them to fieldsToAttend (ranked)
+    # Fields reserved for other agents by the central allocator are not free
+
+    def claimTargets(self, candidates, scores, best, columns):
+        knowledge = self.model.knowledgeMap
+        free = knowledge.taken[candidates] == 0
+        if self.model.allocator is not None:
+            free &= ~self.model.allocator.reserved[candidates]
+        extras = numpy.flatnonzero(free & numpy.isin(
+            knowledge.fieldPositions[candidates, 0], columns))
+        extras = extras[extras != best]
+        selected = numpy.concatenate(
+            ([best], extras[rankTargets(scores[extras])])).astype(int)
+        for index in selected[rankTargets(scores[selected])]:
+            field = knowledge.fieldAgents[candidates[index]]
+            field.taken = 1
+            self.fieldsToAttend.append((float(scores[index]), field))
 
     # Check if the tool is good for the field adjacent to the agent
 
@@ -765,21 +893,13 @@ class ActiveAgent(Agent):
     # This calculates the shortest path based on all possible points
 
     def calculatePath(self, moveTo):
-        near = list()
-        # These are the two possible locations for every field
-        near.append(
-            (moveTo.pos[0]-1, moveTo.pos[1]))
-        near.append(
-            (moveTo.pos[0]+1, moveTo.pos[1]))
-
-        # If there is a top or bottom field, there is also an alternitve point it can go
-        if moveTo.pos[1] == 1:
-            near.append((moveTo.pos[0], 0))
-        elif moveTo.pos[1] == 48:
-            near.append((moveTo.pos[0], 49))
+        layout = self.model.layout
+        # These are the free cells next to the field: left and right, and the headland above or below
+        # the first and last field of a column
+        near = layout.approaches(moveTo.pos)
 
         # Calculate the shortest path based on agents point and the other possible points
-        steps = astar.solve(self.pos, near)
+        steps = astar.solve(self.pos, near, layout.walls, layout.headlands)
 
         temp = 0
         if steps:
@@ -792,46 +912,12 @@ class ActiveAgent(Agent):
         near.clear()
 
     # This functions calculates the priority of the tools
+    # The demand for every tool is kept up to date by the AgentKnowledgeMap (see AgentKnowledgeMap.toolDemand)
+    # Ranked from the lowest to the highest priority
 
     def calculatePriorityTool(self):
-        irrigator = 0
-        plow = 0
-        sprayer = 0
-        wacker = 0
-        harvester = 0
-        seeder = 0
-
-        listOfFieldsFromKnowledge = [
-            obj for obj in self.model.knowledgeMap.navigationGrid if isinstance(obj, PassiveAgentPerception)]
-
-        for obj in listOfFieldsFromKnowledge:
-            pointOfInterest = self.model.schedule.getPassiveAgent(
-                obj.unique_id)
-            if pointOfInterest.machine.current_state.value == "start":
-                plow += 0.75*(1-pointOfInterest.taken)
-            elif pointOfInterest.machine.current_state.value == "plowed":
-                seeder += 1*(1-pointOfInterest.taken)
-            elif pointOfInterest.machine.current_state.value == "seed_dry" or pointOfInterest.machine.current_state.value == "growing_dry" or pointOfInterest.machine.current_state.value == "flowering_dry" or pointOfInterest.machine.current_state.value == "harvestable_dry":
-                irrigator += 1*(pointOfInterest.time_at_current_state /
-                                pointOfInterest.max_steps_dehydrated)*(1-pointOfInterest.taken)
-            elif pointOfInterest.machine.current_state.value == "seed_weeds" or pointOfInterest.machine.current_state.value == "growing_weeds" or pointOfInterest.machine.current_state.value == "flowering_weeds" or pointOfInterest.machine.current_state.value == "harvestable_weeds":
-                wacker += 1*(pointOfInterest.time_at_current_state /
-                             pointOfInterest.max_steps_weeds)*(1-pointOfInterest.taken)
-            elif pointOfInterest.machine.current_state.value == "seed_sick" or pointOfInterest.machine.current_state.value == "growing_sick" or pointOfInterest.machine.current_state.value == "flowering_sick" or pointOfInterest.machine.current_state.value == "harvestable_sick":
-                sprayer += 1*(pointOfInterest.time_at_current_state /
-                              pointOfInterest.max_steps_sick)*(1-pointOfInterest.taken)
-            elif pointOfInterest.machine.current_state.value == "harvestable":
-                harvester = 1*(1-pointOfInterest.taken)
-
-        priority = list()
-        priority = prioritizeQueue(priority, (plow, "plow"))
-        priority = prioritizeQueue(priority, (seeder, "seeder"))
-        priority = prioritizeQueue(priority, (irrigator, "irrigator"))
-        priority = prioritizeQueue(priority, (wacker, "wacker"))
-        priority = prioritizeQueue(priority, (sprayer, "sprayer"))
-        priority = prioritizeQueue(priority, (harvester, "harvester"))
-
-        return priority
+        demand = self.model.knowledgeMap.toolDemand()
+        return [(demand[index], TOOLS[index]) for index in rankTargets(demand)]
 
     def step(self):
         if self.protocol == "Simple protocol":
@@ -842,33 +928,13 @@ class ActiveAgent(Agent):
             else:
                 if len(self.fieldsToAttend) == 0:
                     self.recalculateHeur = 0
-                    # Get all passiveAgents from the KnowledgeMap
-                    listOfFieldsFromKnowledge = [
-                        obj for obj in self.model.knowledgeMap.navigationGrid if isinstance(obj, PassiveAgentPerception)]
-                    queue = list()
-                    for obj in listOfFieldsFromKnowledge:
-                        pointOfInterest = self.model.schedule.getPassiveAgent(
-                            obj.unique_id)
-                        if self.toolVSfield(pointOfInterest.machine.current_state.value):
-                            queue = prioritizeQueue(
-                                queue, (self.heuristic(pointOfInterest, distance(pointOfInterest.pos, self.pos)), pointOfInterest))
-
-                    # Check the status of all agents from the knowledge map
-                    while queue:
-                        possibleTarget = queue[0]
-                        queue.remove(possibleTarget)
-
-                        if self.toolVSfield(possibleTarget[1].machine.current_state.value):
-                            # If there are no points to attend in the agent's knowledge, add it to its knowledge
-                            if len(self.fieldsToAttend) == 0:
-                                self.fieldsToAttend.append(
-                                    (possibleTarget[0], possibleTarget[1]))
-                                self.calculatePath(possibleTarget[1])
-                                break
-                            # If there is at least a point to attend in the agent's knowledge, get all points it can attend based on the path the agent is going
-                            # Is checking right and left sides of the path
-
-                    queue.clear()
+                    # Get all passiveAgents from the KnowledgeMap that can be attended, and go to the best one
+                    candidates, scores = self.candidateTargets()
+                    for index in rankTargets(scores, 1):
+                        field = self.model.knowledgeMap.fieldAgents[candidates[index]]
+                        self.fieldsToAttend.append(
+                            (float(scores[index]), field))
+                        self.calculatePath(field)
                 if len(self.model.knowledgeMap.planAgents[self.unique_id]) == 0:
                     # If there is at least a field it can attend with the current tool, go there.
                     if len(self.fieldsToAttend) > 0:
@@ -889,37 +955,21 @@ class ActiveAgent(Agent):
             else:
                 if len(self.fieldsToAttend) == 0:
                     self.recalculateHeur = 0
-                    # Get all passiveAgents from the KnowledgeMap
-                    listOfFieldsFromKnowledge = [
-                        obj for obj in self.model.knowledgeMap.navigationGrid if isinstance(obj, PassiveAgentPerception)]
-                    queue = list()
-                    for obj in listOfFieldsFromKnowledge:
-                        pointOfInterest = self.model.schedule.getPassiveAgent(
-                            obj.unique_id)
-                        if self.toolVSfield(pointOfInterest.machine.current_state.value):
-                            queue = prioritizeQueue(
-                                queue, (self.heuristic(pointOfInterest, distance(pointOfInterest.pos, self.pos)), pointOfInterest))
-
-                    # Check the status of all agents from the knowledge map
-                    while queue:
-                        possibleTarget = queue[0]
-                        queue.remove(possibleTarget)
-
-                        if possibleTarget[1].taken == 0 and self.toolVSfield(possibleTarget[1].machine.current_state.value):
-                            # If there are no points to attend in the agent's knowledge, add it to its knowledge
-                            if len(self.fieldsToAttend) == 0:
-                                possibleTarget[1].taken = 1
-                                self.fieldsToAttend.append(
-                                    (possibleTarget[0], possibleTarget[1]))
-                                self.calculatePath(possibleTarget[1])
-                            # If there is at least a point to attend in the agent's knowledge, get all points it can attend based on the path the agent is going
-                            # Is checking right and left sides of the path
-
-                            elif len(self.fieldsToAttend) != 0 and len(self.model.knowledgeMap.planAgents[self.unique_id]) > 0 and (possibleTarget[1].pos[0] == self.model.knowledgeMap.planAgents[self.unique_id][len(self.model.knowledgeMap.planAgents[self.unique_id])-1].pos[0]-1 or
-                                                                                                                                    possibleTarget[1].pos[0] == self.model.knowledgeMap.planAgents[self.unique_id][len(self.model.knowledgeMap.planAgents[self.unique_id])-1].pos[0]+1):
-                                possibleTarget[1].taken = 1
-                                self.fieldsToAttend = prioritizeQueue(
-                                    self.fieldsToAttend, (possibleTarget[0], possibleTarget[1]))
+                    # Get all passiveAgents from the KnowledgeMap that can be attended
+                    candidates, scores = self.candidateTargets()
+                    best = self.chooseTarget(candidates, scores)
+                    if best is not None:
+                        self.calculatePath(
+                            self.model.knowledgeMap.fieldAgents[candidates[best]])
+
+                        # Also take all points it can attend based on the path the agent is going
+                        # Is checking right and left sides of the path
+                        my_plans = self.model.knowledgeMap.planAgents[self.unique_id]
+                        columns = ()
+                        if len(my_plans) > 0:
+                            columns = (my_plans[-1].pos[0] - 1,
+                                       my_plans[-1].pos[0] + 1)
+                        self.claimTargets(candidates, scores, best, columns)
 
                 if len(self.model.knowledgeMap.planAgents[self.unique_id]) == 0:
                     # If there is at least a field it can attend with the current tool, go there.
@@ -943,34 +993,14 @@ class ActiveAgent(Agent):
                     self.recalculateHeur = 0
                     self.coordinationCheck = 0
                     self.search = 0
-                    # Get all passiveAgents from the KnowledgeMap
-                    listOfFieldsFromKnowledge = [
-                        obj for obj in self.model.knowledgeMap.navigationGrid if isinstance(obj, PassiveAgentPerception)]
-                    queue = list()
-                    for obj in listOfFieldsFromKnowledge:
-                        pointOfInterest = self.model.schedule.getPassiveAgent(
-                            obj.unique_id)
-                        if self.toolVSfield(pointOfInterest.machine.current_state.value):
-                            queue = prioritizeQueue(
-                                queue, (self.heuristic(pointOfInterest, distance(pointOfInterest.pos, self.pos)), pointOfInterest))
-
-                    # Check the status of all agents from the knowledge map
-                    while queue:
-                        possibleTarget = queue[0]
-                        queue.remove(possibleTarget)
-
-                        if possibleTarget[1].taken == 0 and self.toolVSfield(possibleTarget[1].machine.current_state.value):
-                            # If there are no points to attend in the agent's knowledge, add it to its knowledge
-                            if len(self.fieldsToAttend) == 0:
-                                possibleTarget[1].taken = 1
-                                self.fieldsToAttend.append(
-                                    (possibleTarget[0], possibleTarget[1]))
-
-                            # If there is at least a point to attend in the agent's knowledge, get all points it can attend on that row based on the first point he added
-                            elif len(self.fieldsToAttend) != 0 and possibleTarget[1].pos[0] == self.fieldsToAttend[0][1].pos[0]:
-                                possibleTarget[1].taken = 1
-                                self.fieldsToAttend = prioritizeQueue(
-                                    self.fieldsToAttend, (possibleTarget[0], possibleTarget[1]))
+                    # Get all passiveAgents from the KnowledgeMap that can be attended
+                    candidates, scores = self.candidateTargets()
+                    best = self.chooseTarget(candidates, scores)
+
+                    # Take the best point and all points it can attend on the same row
+                    if best is not None:
+                        self.claimTargets(candidates, scores, best,
+                                          (self.model.knowledgeMap.fieldPositions[candidates[best], 0],))
 
                 if len(self.model.knowledgeMap.planAgents[self.unique_id]) == 0:
                     # If there is at least a field it can attend with the current tool, go there.
@@ -1089,12 +1119,13 @@ class ActiveAgent(Agent):
             # or its help is not needed. Therefore, it goes to a random point in the field and updates the states on the way
             # (Searching for Helper-Based Protocol)
             if (self.current_tool == None or (self.protocol == "Coordination Cooperative protocol" and self.coordinationCheck == 1)) and len(self.fieldsToAttend) == 0 and self.search == 0:
-                seed(datetime.now())
-                listOfFieldsFromKnowledge = [
-                    obj for obj in self.model.knowledgeMap.navigationGrid if isinstance(obj, PassiveAgentPerception)]
+                # The model's random generator is used, so runs are reproducible from the model seed
+                # The perceptions are kept in the order of the fields (x-major, the order of the navigationGrid cells)
+                listOfFieldsFromKnowledge = list(
+                    self.model.knowledgeMap.perceptionAgents.values())
                 self.fieldsToAttend.append(
-                    (1, listOfFieldsFromKnowledge[randint(0, len(listOfFieldsFromKnowledge)-1)]))
-                self.calculatePath(listOfFieldsFromKnowledge[randint(
+                    (1, listOfFieldsFromKnowledge[self.random.randint(0, len(listOfFieldsFromKnowledge)-1)]))
+                self.calculatePath(listOfFieldsFromKnowledge[self.random.randint(
                     0, len(listOfFieldsFromKnowledge)-1)])
                 self.search = 1
 
@@ -1136,131 +1167,49 @@ class FarmAgent(Agent):
     x = None
     y = None
 
+    '''
+    *** The tools at the farm are kept in inventory, indexed by states.TOOL_IDS
+    *** checkouts, returns and stockouts (requests for a tool that is not in stock) are counted per tool
+    '''
+
     def __init__(self, unique_id, pos, model):
         super().__init__(unique_id, model)
         self.pos = pos
         self.food = 0
-        self.irrigator = 100
-        self.plow = 100
-        self.sprayer = 100
-        self.wacker = 100
-        self.harvester = 100
-        self.seeder = 100
+        self.inventory = numpy.full(len(TOOLS), 100, dtype=int)
+        self.checkouts = numpy.zeros(len(TOOLS), dtype=int)
+        self.returns = numpy.zeros(len(TOOLS), dtype=int)
+        self.stockouts = numpy.zeros(len(TOOLS), dtype=int)
 
     def sample_stage(self):
         return
 
-    def interact(self, agent):
-        # print("Updating agent tool")
-        tool = agent.current_tool
-        if tool != None:
-            if tool == 'irrigator':
-                self.irrigator += 1
-            elif tool == 'plow':
-                self.plow += 1
-            elif tool == 'spray':
-                self.sprayer += 1
-            elif tool == 'wacker':
-                self.wacker += 1
-            elif tool == 'harvester':
-                self.harvester += 1
-            elif tool == 'seeder':
-                self.seeder += 1
-        agent.current_tool = None
-        # Plow, seed, water, weeds, cure, harvest
-        plantCount = [0, 0, 0, 0, 0, 0]
-        for passiveAgent in self.model.knowledgeMap.perceptionAgents:
-            fieldState = self.model.knowledgeMap.perceptionAgents[passiveAgent].state.value
-            if fieldState == "start" and self.plow > 0:
-                plantCount[0] += 1
-            elif fieldState == "plowed" and self.seeder > 0:
-                plantCount[1] += 1
-            elif (fieldState == "seed_dry" or fieldState == "growing_dry" or fieldState == "flowering_dry" or fieldState == "harvestable_dry") and self.irrigator > 0:
-                plantCount[2] += 1
-            elif (fieldState == "seed_weeds" or fieldState == "growing_weeds" or fieldState == "flowering_weeds" or fieldState == "harvestable_weeds") and self.wacker > 0:
-                plantCount[3] += 1
-            elif (fieldState == "seed_sick" or fieldState == "growing_sick" or fieldState == "flowering_sick" or fieldState == "harvestable_sick") and self.sprayer > 0:
-                plantCount[4] += 1
-            elif fieldState == "harvestable" and self.harvester > 0:
-                plantCount[5] += 1
-
-        def f(i): return plantCount[i]
-        argmax = max(range(len(plantCount)), key=f)
-        if argmax == 0:  # Plower
-            self.plow -= 1
-            agent.current_tool = "plow"
-        elif argmax == 1:  # Seeder
-            self.seeder -= 1
-            agent.current_tool = "seeder"
-        elif argmax == 2:  # Irrigator
-            self.irrigator -= 1
-            agent.current_tool = "irrigator"
-        elif argmax == 3:  # Whacker
-            self.wacker -= 1
-            agent.current_tool = "wacker"
-        elif argmax == 4:  # sprayer
-            self.sprayer -= 1
-            agent.current_tool = "sprayer"
-        elif argmax == 5:  # Harvester
-            self.harvester -= 1
-            agent.current_tool = "harvester"
-
     def interact2(self, target, tool):  # for the taking and returning of farm equipment
         if tool != None:
-            if tool == 'irrigator':
-                self.irrigator += 1
-                return True
-            elif tool == 'plow':
-                self.plow += 1
-                return True
-            elif tool == 'spray':
-                self.sprayer += 1
-                return True
-        elif target == 'watering' and self.irrigator > 0:
-            self.irrigator -= 1
-            return True
-        elif target == 'plowing' and self.plow > 0:
-            self.plow -= 1
-            return True
-        elif target == 'spraying' and self.sprayer > 0:
-            self.sprayer -= 1
-            return True
-        else:
-            return False
+            return self.return_tool(tool)
+        return self.take_tool({'watering': 'irrigator', 'plowing': 'plow', 'spraying': 'sprayer'}.get(target))
 
     def return_tool(self, tool):
-        if tool != None:
-            if tool == 'irrigator':
-                self.irrigator += 1
-            elif tool == 'plow':
-                self.plow += 1
-            elif tool == 'sprayer':
-                self.sprayer += 1
-            elif tool == 'wacker':
-                self.wacker += 1
-            elif tool == 'harvester':
-                self.harvester += 1
-            elif tool == 'seeder':
-                self.seeder += 1
+        index = TOOL_IDS.get(tool)
+        if index is None:
+            return False
+        self.inventory[index] += 1
+        self.returns[index] += 1
+        return True
 
     def take_tool(self, requestedTool):
-        if requestedTool == 'irrigator' and self.irrigator > 0:
-            self.irrigator -= 1
-            return True
-        elif requestedTool == 'plow' and self.plow > 0:
-            self.plow -= 1
-            return True
-        elif requestedTool == 'sprayer' and self.sprayer > 0:
-            self.sprayer -= 1
-            return True
-        elif requestedTool == 'wacker' and self.wacker > 0:
-            self.wacker -= 1
-            return True
-        elif requestedTool == 'harvester' and self.harvester > 0:
-            self.harvester -= 1
-            return True
-        elif requestedTool == 'seeder' and self.seeder > 0:
-            self.seeder -= 1
-            return True
-        else:
+        index = TOOL_IDS.get(requestedTool)
+        if index is None:
+            return False
+        if self.inventory[index] == 0:
+            self.stockouts[index] += 1
             return False
+        self.inventory[index] -= 1
+        self.checkouts[index] += 1
+        return True
+
+    # Checkout statistics per tool
+    def statistics(self):
+        return {tool: {"in_stock": int(self.inventory[index]), "checkouts": int(self.checkouts[index]),
+                       "returns": int(self.returns[index]), "stockouts": int(self.stockouts[index])}
+                for index, tool in enumerate(TOOLS)}
@@ -0,0 +1,136 @@
+import numpy
+import pandas as pd
+
+'''
+*** StreamingAggregate summarizes replicate runs per step and metric while the runs come in
+*** Only the running statistics are kept, never the replicates themselves:
+                - mean and variance with Welford's online algorithm
+                - quantiles with the P-square algorithm (Jain and Chlamtac), five markers per quantile
+*** Every statistic is a numpy array over (step, metric), so a run is added with a few array operations per quantile
+*** Until 5 values are seen, the quantiles are computed exactly from the values kept in the markers
+'''
+
+
+class StreamingAggregate():
+
+    '''
+    *** Constructor:
+        Inputs:
+               - rows: number of steps per run
+               - columns: names of the metrics
+               - quantiles: probabilities of the quantiles to estimate
+    '''
+
+    def __init__(self, rows, columns, quantiles=(0.05, 0.5, 0.95)):
+        self.columns = list(columns)
+        self.quantiles = tuple(quantiles)
+        shape = (rows, len(self.columns))
+        self.count = numpy.zeros(shape, dtype=int)
+        self.mean = numpy.zeros(shape)
+        self.m2 = numpy.zeros(shape)
+
+        # P-square markers: heights and (1-based) positions per quantile
+        self.heights = numpy.full((len(self.quantiles),) + shape + (5,), numpy.nan)
+        self.positions = numpy.tile(numpy.arange(1.0, 6.0),
+                                    (len(self.quantiles),) + shape + (1,))
+        self.increments = [numpy.array([0, p / 2, p, (1 + p) / 2, 1])
+                           for p in self.quantiles]
+
+    '''
+    *** update adds the values of one run (or of a part of it, starting at step start)
+        Input:
+              - values: array of shape (steps, metrics)
+    '''
+
+    def update(self, values, start=0):
+        values = numpy.asarray(values, dtype=float)
+        rows = slice(start, start + len(values))
+        count = self.count[rows]
+
+        # Welford
+        count += 1
+        delta = values - self.mean[rows]
+        self.mean[rows] += delta / count
+        self.m2[rows] += delta * (values - self.mean[rows])
+
+        for index in range(len(self.quantiles)):
+            self.updateQuantile(index, rows, values, count)
+
+    def updateQuantile(self, index, rows, values, count):
+        heights = self.heights[index][rows]
+        positions = self.positions[index][rows]
+
+        # The first 5 values are stored in the markers, sorted when the fifth one arrives
+        filling = count <= 5
+        heights[filling, count[filling] - 1] = values[filling]
+        full = count == 5
+        heights[full] = numpy.sort(heights[full], axis=-1)
+
+        active = count > 5
+        q = heights[active]
+        n = positions[active]
+        x = values[active]
+        if len(x) == 0:
+            return
+
+        # Find the cell of x, extending the extreme markers if needed
+        q[:, 0] = numpy.minimum(q[:, 0], x)
+        q[:, 4] = numpy.maximum(q[:, 4], x)
+        cell = (x[:, None] >= q[:, 1:4]).sum(axis=1)
+        n += numpy.arange(5) > cell[:, None]
+        desired = 1 + (count[active] - 1)[:, None] * self.increments[index]
+
+        # Adjust the middle markers (parabolic prediction, linear if that leaves the neighbors' range)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            for i in (1, 2, 3):
+                d = desired[:, i] - n[:, i]
+                move = ((d >= 1) & (n[:, i + 1] - n[:, i] > 1)) | \
+                    ((d <= -1) & (n[:, i - 1] - n[:, i] < -1))
+                d = numpy.where(move, numpy.sign(d), 0)
+                parabolic = q[:, i] + d / (n[:, i + 1] - n[:, i - 1]) * (
+                    (n[:, i] - n[:, i - 1] + d) * (q[:, i + 1] - q[:, i]) / (n[:, i + 1] - n[:, i]) +
+                    (n[:, i + 1] - n[:, i] - d) * (q[:, i] - q[:, i - 1]) / (n[:, i] - n[:, i - 1]))
+                neighbor = numpy.where(d > 0, i + 1, i - 1)
+                qn = numpy.take_along_axis(q, neighbor[:, None], 1)[:, 0]
+                nn = numpy.take_along_axis(n, neighbor[:, None], 1)[:, 0]
+                linear = q[:, i] + d * (qn - q[:, i]) / (nn - n[:, i])
+                inside = (q[:, i - 1] < parabolic) & (parabolic < q[:, i + 1])
+                q[:, i] = numpy.where(move, numpy.where(
+                    inside, parabolic, linear), q[:, i])
+                n[:, i] += d
+
+        heights[active] = q
+        positions[active] = n
+
+    def variance(self):
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            return numpy.where(self.count > 1, self.m2 / (self.count - 1), numpy.nan)
+
+    def quantile(self, index):
+        estimate = self.heights[index][..., 2]
+        with numpy.errstate(all="ignore"):
+            exact = numpy.nanquantile(
+                self.heights[index], self.quantiles[index], axis=-1)
+        return numpy.where(self.count > 5, estimate, exact)
+
+    # Summary table: one row per step, columns (metric, statistic)
+    def summary(self):
+        statistics = {"count": self.count, "mean": self.mean,
+                      "var": self.variance(), "std": numpy.sqrt(self.variance())}
+        for index, p in enumerate(self.quantiles):
+            statistics["q{:g}".format(100 * p)] = self.quantile(index)
+        data = {(column, name): values[:, j] for j, column in enumerate(self.columns)
+                for name, values in statistics.items()}
+        frame = pd.DataFrame(data)
+        frame.index.name = "Step"
+        return frame
+
+    # Add a run of a ResultsStore, chunk by chunk (see ag_sim/results.py)
+    def update_from_store(self, store, run_id):
+        start = 0
+        for chunk in zip(*(store.chunks(run_id, column) for column in self.columns)):
+            values = numpy.column_stack(chunk)[:len(self.count) - start]
+            if len(values) == 0:
+                break
+            self.update(values, start)
+            start += len(values)
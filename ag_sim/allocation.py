@@ -0,0 +1,83 @@
+import numpy
+from ag_sim.targeting import fieldUrgency, stateLimits
+from ag_sim.states import TOOL_MASKS, NO_TOOL_MASK
+
+'''
+*** TaskAllocator is an optional central allocator for the "Helper-Based protocol" and the "Coordination Cooperative protocol"
+*** Enabled with the "central_allocation" model parameter
+*** Once per tick (before the schedule steps), it assigns a field to every ActiveAgent that is looking for a new target:
+                - a robot x field cost matrix is built with targeting.fieldUrgency for all those agents at once
+                - fields that cannot be attended with the agent's tool or are taken cost infinity
+                - the assignment is a greedy matching: the cheapest (agent, field) pair is assigned first,
+                  then the agent and the field are removed, until no agent or field is left
+*** The ActiveAgents then claim their assigned field in their step instead of searching the KnowledgeMap themselves;
+*** fields assigned to other agents are reserved, so the agents no longer race for the same field in scheduler order
+'''
+
+
+'''
+*** greedyAssignment matches the rows (agents) of a cost matrix to its columns (fields)
+    Input:
+          - costs: m x n cost matrix, infinity for pairs that cannot be assigned
+    Output:
+          - list of (row, column) pairs, cheapest first
+*** Ties are given to the first agent and, like targeting.rankTargets, to the later field
+'''
+
+
+def greedyAssignment(costs):
+    costs = numpy.array(costs, dtype=float)[:, ::-1]
+    rows, columns = costs.shape
+    pairs = list()
+    for _ in range(min(rows, columns)):
+        index = numpy.argmin(costs)
+        row, column = divmod(int(index), columns)
+        if not numpy.isfinite(costs[row, column]):
+            break
+        pairs.append((row, columns - 1 - column))
+        costs[row, :] = numpy.inf
+        costs[:, column] = numpy.inf
+    return pairs
+
+
+class TaskAllocator():
+
+    def __init__(self, model, **model_params):
+        self.model = model
+        self.limits = stateLimits(model_params["max_steps_dehydrated"],
+                                  model_params["max_steps_weeds"], model_params["max_steps_sick"])
+        self.assigned = {}
+        self.reserved = numpy.zeros(0, dtype=bool)
+
+    # An agent looks for a new target when it has a tool and nothing left to attend (see ActiveAgent.step)
+    def needsTarget(self, agent):
+        return agent.stepCount > 0 and agent.current_tool is not None and len(agent.fieldsToAttend) == 0
+
+    # Assign fields to all agents looking for a target; called once per tick by AgSimulator.step
+    def allocate(self):
+        knowledge = self.model.knowledgeMap
+        self.assigned = {}
+        self.reserved = numpy.zeros(len(knowledge.stateCodes), dtype=bool)
+
+        agents = [agent for agent in self.model.activeAgents if self.needsTarget(agent)]
+        if len(agents) == 0:
+            return
+
+        codes = knowledge.stateCodes
+        costs = fieldUrgency(codes, knowledge.stateTimes, knowledge.taken, knowledge.fieldPositions,
+                             [agent.pos for agent in agents], self.limits, self.model.layout.headlands)
+        valid = numpy.array([TOOL_MASKS.get(agent.current_tool, NO_TOOL_MASK)[codes]
+                             for agent in agents]) & (knowledge.taken == 0)
+
+        for row, field in greedyAssignment(numpy.where(valid, costs, numpy.inf)):
+            self.assigned[agents[row].unique_id] = field
+            self.reserved[field] = True
+
+    # Position in candidates of the field assigned to the agent (None if it got no field)
+    def assignedTarget(self, agent, candidates):
+        field = self.assigned.pop(agent.unique_id, None)
+        if field is None:
+            return None
+        self.reserved[field] = False
+        position = numpy.flatnonzero(candidates == field)
+        return position[0] if len(position) > 0 else None
@@ -0,0 +1,132 @@
+import glob
+import hashlib
+import json
+import os
+import shutil
+import numpy
+import astar
+
+'''
+*** ResultCache keeps the runs of a ResultsStore by the configuration that produced them, so a run that was done
+*** before (in any store) is copied instead of simulated again
+*** The key of a run is a SHA-256 hash of its canonical configuration:
+                - model parameters, seed, number of steps, recorded columns and whether the run stops once settled
+                  (as JSON with sorted keys)
+                - code version: a hash of the model sources (ag_sim/*.py and astar.py), so any change of the code
+                  makes new keys
+*** Layout of a cache directory: one directory per key with the chunk files of the run and its run.json
+*** The cache is bounded by max_bytes: when it grows beyond, the least recently used runs are removed
+*** (the modification time of run.json is the last use)
+'''
+
+
+_codeVersion = None
+
+
+def codeVersion():
+    global _codeVersion
+    if _codeVersion is None:
+        digest = hashlib.sha256()
+        sources = sorted(glob.glob(os.path.join(os.path.dirname(__file__), "*.py"))) + [astar.__file__]
+        for source in sources:
+            with open(source, "rb") as file:
+                digest.update(file.read())
+        _codeVersion = digest.hexdigest()
+    return _codeVersion
+
+
+# JSON for values that json does not know (numpy scalars, ranges, ...)
+def canonicalValue(value):
+    if isinstance(value, numpy.generic):
+        return value.item()
+    if isinstance(value, (range, tuple, set)):
+        return list(value)
+    return repr(value)
+
+
+def configKey(params, seed, steps, columns, stop_when_settled=False, code_version=None):
+    config = {"params": params, "seed": seed, "steps": steps, "columns": list(columns),
+              "stop_when_settled": stop_when_settled, "code": code_version or codeVersion()}
+    text = json.dumps(config, sort_keys=True, separators=(",", ":"), default=canonicalValue)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class ResultCache():
+
+    '''
+    *** Constructor:
+        Inputs:
+               - path of the cache directory
+               - max_bytes: size the cache is kept under
+    '''
+
+    def __init__(self, path, max_bytes=2 ** 30):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+
+    def directory(self, key):
+        return os.path.join(self.path, key)
+
+    '''
+    *** fetch copies the cached run of key into the run directory of store
+        Output:
+              - manifest entry of the run (with the given metadata), or None if key is not cached
+    '''
+
+    def fetch(self, key, store, run_id, metadata=None):
+        source = os.path.join(self.directory(key), "run.json")
+        try:
+            with open(source) as file:
+                cached = json.load(file)
+        except (OSError, ValueError):
+            return None
+        os.utime(source)
+
+        target = os.path.join(store.path, run_id)
+        shutil.rmtree(target, ignore_errors=True)
+        shutil.copytree(self.directory(key), target)
+        entry = dict(metadata or {}, run=run_id, columns=cached["columns"], rows=cached["rows"],
+                     chunks=cached["chunks"], cached=True)
+        for name in ("settled", "replay"):
+            if name in cached:
+                entry[name] = cached[name]
+        with open(os.path.join(target, "run.json"), "w") as file:
+            json.dump(entry, file)
+        return entry
+
+    # Add a closed run of store under key, then evict the least recently used runs if the cache is too large
+    def add(self, key, store, entry):
+        temporary = self.directory(key) + ".tmp"
+        shutil.rmtree(temporary, ignore_errors=True)
+        shutil.copytree(os.path.join(store.path, entry["run"]), temporary)
+        shutil.rmtree(self.directory(key), ignore_errors=True)
+        os.replace(temporary, self.directory(key))
+        self.evict()
+
+    def entries(self):
+        entries = list()
+        for key in os.listdir(self.path):
+            directory = self.directory(key)
+            try:
+                used = os.path.getmtime(os.path.join(directory, "run.json"))
+                size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+            except OSError:
+                continue
+            entries.append((used, size, key))
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        while entries and total > self.max_bytes:
+            _, size, key = entries.pop(0)
+            shutil.rmtree(self.directory(key), ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        for _, _, key in self.entries():
+            shutil.rmtree(self.directory(key), ignore_errors=True)
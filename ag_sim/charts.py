@@ -0,0 +1,122 @@
+import json
+import numpy
+from mesa.visualization.ModularVisualization import VisualizationElement
+from ag_sim.states import TOOLS
+
+'''
+*** MinMaxChart is a line chart of model series whose size in the browser stays bounded however long the run is
+*** The steps are divided into buckets of width steps; every series keeps the minimum and maximum of its values per
+*** bucket (drawn as a band, ag_sim/js/MinMaxChartModule.js)
+*** When the run gets longer than max_buckets buckets, neighbouring buckets are merged and the width doubles
+*** A frame only sends the buckets that changed since the last frame (normally the last one or two); after a merge,
+*** or for a new model, all buckets are sent again (at most max_buckets)
+*** A series is:
+                - the name of a model reporter of the datacollector: all values recorded since the last frame are added,
+                  so no step is missed when the model runs ahead of the frames (see ag_sim/liveserver.py)
+                - or a function of the model: one value is added per frame
+*** Like the delta grid, the chart keeps the last frame, so it is meant for one browser at a time
+'''
+
+
+class MinMaxChart(VisualizationElement):
+    package_includes = ["Chart.min.js"]
+    local_includes = ["ag_sim/js/MinMaxChartModule.js"]
+
+    '''
+    *** Constructor:
+        Inputs:
+               - series: list of dictionaries with the "Label" and "Color" of every series, and an optional
+                 "Function" of the model (without a function, Label is the name of a model reporter)
+               - max_buckets: maximum number of buckets per series
+               - canvas_width, canvas_height: size of the chart
+    '''
+
+    def __init__(self, series, max_buckets=500, canvas_width=500, canvas_height=200):
+        self.series = series
+        # Buckets are merged in pairs
+        self.max_buckets = max_buckets + max_buckets % 2
+        labels = [{"Label": entry["Label"], "Color": entry["Color"]} for entry in series]
+        self.js_code = "elements.push(new MinMaxChartModule({}, {}, {}));".format(
+            json.dumps(labels), canvas_width, canvas_height)
+        self.model = None
+
+    def restart(self, model):
+        self.model = model
+        self.width = 1
+        self.mins = numpy.full((len(self.series), self.max_buckets), numpy.nan)
+        self.maxs = numpy.full((len(self.series), self.max_buckets), numpy.nan)
+        self.used = 0
+        self.read = [0] * len(self.series)
+        self.reset = True
+
+    # Merge neighbouring buckets, doubling their width
+    def merge(self):
+        pairs = self.mins.reshape(len(self.series), -1, 2)
+        self.mins = numpy.concatenate((numpy.fmin(pairs[:, :, 0], pairs[:, :, 1]),
+                                       numpy.full_like(pairs[:, :, 0], numpy.nan)), axis=1)
+        pairs = self.maxs.reshape(len(self.series), -1, 2)
+        self.maxs = numpy.concatenate((numpy.fmax(pairs[:, :, 0], pairs[:, :, 1]),
+                                       numpy.full_like(pairs[:, :, 0], numpy.nan)), axis=1)
+        self.width *= 2
+        self.used = (self.used + 1) // 2
+        self.reset = True
+
+    # Steps and values of a series since the last frame
+    def newValues(self, index, model):
+        entry = self.series[index]
+        if "Function" in entry:
+            return numpy.array([model.schedule.steps]), numpy.array([entry["Function"](model)], dtype=float)
+        collector = model.datacollector
+        steps = collector.model_steps.array()[self.read[index]:]
+        values = collector.model_vars[entry["Label"]].array()[self.read[index]:]
+        self.read[index] += len(steps)
+        return steps, values.astype(float)
+
+    def render(self, model):
+        if model is not self.model:
+            self.restart(model)
+        while model.schedule.steps // self.width >= self.max_buckets:
+            self.merge()
+
+        start = self.used
+        for index in range(len(self.series)):
+            steps, values = self.newValues(index, model)
+            if len(steps) == 0:
+                continue
+            buckets, first = numpy.unique(steps // self.width, return_index=True)
+            self.mins[index, buckets] = numpy.fmin(self.mins[index, buckets], numpy.minimum.reduceat(values, first))
+            self.maxs[index, buckets] = numpy.fmax(self.maxs[index, buckets], numpy.maximum.reduceat(values, first))
+            start = min(start, buckets[0])
+            self.used = max(self.used, buckets[-1] + 1)
+
+        if self.reset:
+            start = 0
+        frame = {"reset": self.reset, "width": self.width, "start": int(start),
+                 "min": [[None if numpy.isnan(value) else value for value in row[start:self.used].tolist()]
+                         for row in self.mins],
+                 "max": [[None if numpy.isnan(value) else value for value in row[start:self.used].tolist()]
+                         for row in self.maxs]}
+        self.reset = False
+        return frame
+
+
+# Fraction of the ActiveAgents that hold a tool
+def robotUtilization(model):
+    return sum(agent.current_tool is not None for agent in model.activeAgents) / max(len(model.activeAgents), 1)
+
+
+TOOL_COLORS = ("#8f713c", "#734b10", "#4f1e8f", "#ff00f2", "#0043fc", "#ffc240")
+
+
+# The charts of the live server: harvest score, unattended steps, demand per tool and robot utilization
+def liveCharts(max_buckets=500):
+    return [
+        MinMaxChart([{"Label": "harvest_score", "Color": "#00CC00"}], max_buckets),
+        MinMaxChart([{"Label": "total_steps_dehydrated", "Color": "#4f1e8f"},
+                     {"Label": "total_steps_sick", "Color": "#0043fc"},
+                     {"Label": "total_steps_weeds", "Color": "#ff00f2"}], max_buckets),
+        MinMaxChart([{"Label": tool + " demand", "Color": color,
+                      "Function": lambda model, index=index: model.knowledgeMap.toolDemand()[index]}
+                     for index, (tool, color) in enumerate(zip(TOOLS, TOOL_COLORS))], max_buckets),
+        MinMaxChart([{"Label": "robot utilization", "Color": "#FF3300", "Function": robotUtilization}], max_buckets),
+    ]
@@ -0,0 +1,256 @@
+import io
+import json
+import os
+import numpy
+from ag_sim.agents import ActiveAgentPlanning, PassiveAgentStateMachine, FarmAgent
+from ag_sim.states import STATE_NAMES, STATE_CODES, TOOLS, TOOL_IDS
+
+'''
+*** Checkpoints of an AgSimulator, to resume long runs
+*** A checkpoint is a single compressed .npz file with the simulation state as flat arrays:
+                - model: parameters, step, scores and the state of the random generator
+                - fields: state, times and counters of every PassiveAgent, and what the knowledge map perceived of it
+                - robots: position, tool, flags, fieldsToAttend and plans of every ActiveAgent
+                - farm: tool inventory and statistics
+                - datacollector: the collected columns
+*** loadCheckpoint builds a new model with the same parameters and overwrites its state, so the resumed run
+*** continues exactly as the original one would have
+*** snapshot returns the same data as bytes, to keep the state in memory (e.g. to fork variants, see ag_sim/variants.py)
+*** Everything else (field arrays, tool demand, subscriptions) is derived again while the state is restored
+'''
+
+# Kinds of the entries in ActiveAgent.fieldsToAttend
+FIELD, FARM, PERCEPTION = 0, 1, 2
+
+# Model parameters that decide the robots and their tools (see ActiveAgent.__init__)
+FLEET_PARAMS = ("com_protocol", "active_agents")
+
+
+def toolId(tool):
+    return TOOL_IDS[tool] if tool is not None else -1
+
+
+def restoreColumn(column, values):
+    column.values = numpy.array(values) if len(values) > 0 else None
+    column.size = len(values)
+
+
+def saveCheckpoint(model, path):
+    # Write to a temporary file first, so a crash while writing never leaves a broken checkpoint
+    temporary = path + ".tmp.npz"
+    numpy.savez_compressed(temporary, **stateArrays(model))
+    os.replace(temporary, path)
+
+
+# The checkpoint of a model as bytes (not compressed, as it is usually loaded again right away)
+def snapshot(model):
+    buffer = io.BytesIO()
+    numpy.savez(buffer, **stateArrays(model))
+    return buffer.getvalue()
+
+
+def stateArrays(model):
+    knowledge = model.knowledgeMap
+    fields = knowledge.fieldAgents
+    robots = model.activeAgents
+    fieldIndexOf = {field.unique_id: index for index,
+                    field in enumerate(fields)}
+    perceptions = [knowledge.perceptionAgents[field.unique_id]
+                   for field in fields]
+
+    version, state, gauss = model.random.getstate()
+    meta = {"params": model.model_params, "height": model.height, "width": model.width,
+            "steps": model.schedule.steps, "time": model.schedule.time, "current_id": model.current_id,
+            "running": model.running, "harvest_score": model.harvest_score,
+            "total_steps_dehydrated": model.total_steps_dehydrated, "total_steps_sick": model.total_steps_sick,
+            "total_steps_weeds": model.total_steps_weeds, "random_version": version, "random_gauss": gauss,
+            "food": model.farmObject.food}
+
+    arrays = {
+        "random_state": numpy.array(state, dtype=numpy.uint32),
+        "field_state": knowledge.stateCodes,
+        "field_time": numpy.array([field.time_at_current_state for field in fields]),
+        "field_prev_healthy": numpy.array([field.time_at_prev_healthy_state for field in fields]),
+        "field_dehydrated": numpy.array([field.steps_in_dehydrated_state for field in fields]),
+        "field_sick": numpy.array([field.steps_in_sick_state for field in fields]),
+        "field_weeds": numpy.array([field.steps_in_weeds_state for field in fields]),
+        "field_water": numpy.array([field.water_level for field in fields]),
+        "field_taken": knowledge.taken,
+        "perception_state": numpy.array([STATE_CODES[perception.state.value] for perception in perceptions], dtype='int8'),
+        "perception_time": numpy.array([perception.time_at_current_state for perception in perceptions]),
+        "perception_taken": numpy.array([perception.taken for perception in perceptions], dtype='int8'),
+        "robot_pos": numpy.array([robot.pos for robot in robots], dtype=int).reshape(-1, 2),
+        "robot_tool": numpy.array([toolId(robot.current_tool) for robot in robots], dtype='int8'),
+        "robot_flags": numpy.array([(robot.stepCount, robot.recalculateHeur, robot.search, getattr(robot, "coordinationCheck", 0))
+                                    for robot in robots], dtype=int).reshape(-1, 4),
+        "farm_inventory": model.farmObject.inventory,
+        "farm_checkouts": model.farmObject.checkouts,
+        "farm_returns": model.farmObject.returns,
+        "farm_stockouts": model.farmObject.stockouts,
+    }
+
+    # fieldsToAttend and plans, flattened with the index of the robot they belong to
+    attend = list()
+    for number, robot in enumerate(robots):
+        for score, target in robot.fieldsToAttend:
+            if isinstance(target, FarmAgent):
+                attend.append((number, FARM, -1, score))
+            elif target.unique_id in fieldIndexOf and target is fields[fieldIndexOf[target.unique_id]]:
+                attend.append((number, FIELD, fieldIndexOf[target.unique_id], score))
+            else:
+                attend.append((number, PERCEPTION, fieldIndexOf[target.unique_id], score))
+    arrays["attend"] = numpy.array([entry[:3] + (isinstance(entry[3], int),) for entry in attend],
+                                   dtype=int).reshape(-1, 4)
+    arrays["attend_score"] = numpy.array([entry[3] for entry in attend], dtype=float)
+    plans = [(number, plan.pos[0], plan.pos[1], plan.steps_left) for number, robot in enumerate(robots)
+             for plan in knowledge.planAgents[robot.unique_id]]
+    arrays["plans"] = numpy.array(plans, dtype=int).reshape(-1, 4)
+
+    # Collected data; columns of other values than numbers (e.g. timing) are not kept
+    collector = model.datacollector
+    meta["model_columns"] = [name for name, column in collector.model_vars.items()
+                             if column.array().dtype != object]
+    arrays["model_steps"] = collector.model_steps.array()
+    for name in meta["model_columns"]:
+        arrays["model_" + name] = collector.model_vars[name].array()
+    meta["agent_columns"] = list(collector.agent_vars)
+    arrays["agent_steps"] = collector.agent_steps.array()
+    arrays["agent_ids"] = collector.agent_ids.array()
+    for name in meta["agent_columns"]:
+        arrays["agent_" + name] = collector.agent_vars[name].array()
+    meta["last_agent_rows"] = [[uid, list(row)] for uid, row in collector.last_agent_rows.items()]
+    meta["last_model_row"] = list(collector.last_model_row) if collector.last_model_row is not None and \
+        len(meta["model_columns"]) == len(collector.model_vars) else None
+
+    arrays["meta"] = numpy.frombuffer(json.dumps(meta).encode(), dtype=numpy.uint8)
+    return arrays
+
+
+'''
+*** loadCheckpoint creates the model of a checkpoint
+    Input:
+          - source: path of a checkpoint file, or bytes returned by snapshot
+    Optional:
+          - overrides: model parameters that replace those of the checkpoint; the model is built with the new
+            parameters and gets the state of the checkpoint
+            *** Overrides of the fleet (com_protocol or active_agents) keep the robots as the new model built them:
+                the tools the protocol gives them, no targets, no plans and no taken fields; the first robots only
+                get the positions of the saved ones, the others start at the farm, and all saved tools are returned
+                to the farm
+          - seed: reseed the random generator instead of continuing the saved random stream
+'''
+
+
+def loadCheckpoint(source, overrides=None, seed=None):
+    from ag_sim.model import AgSimulator
+
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    with numpy.load(source) as data:
+        arrays = {name: data[name] for name in data.files}
+    meta = json.loads(arrays["meta"].tobytes().decode())
+
+    params = dict(meta["params"], **(overrides or {}))
+    newFleet = any(params.get(name) != meta["params"].get(name) for name in FLEET_PARAMS)
+    if seed is not None:
+        params["seed"] = seed
+    model = AgSimulator(meta["height"], meta["width"], **params)
+    knowledge = model.knowledgeMap
+    fields = knowledge.fieldAgents
+    robots = model.activeAgents
+
+    model.schedule.steps = meta["steps"]
+    model.schedule.time = meta["time"]
+    model.current_id = meta["current_id"]
+    model.running = meta["running"]
+    for name in ("harvest_score", "total_steps_dehydrated", "total_steps_sick", "total_steps_weeds"):
+        setattr(model, name, meta[name])
+    if seed is None:
+        model.random.setstate((meta["random_version"], tuple(int(value) for value in arrays["random_state"]),
+                               meta["random_gauss"]))
+
+    for index, field in enumerate(fields):
+        state = STATE_NAMES[arrays["field_state"][index]]
+        if field.machine.current_state_value != state:
+            field.machine.current_state_value = state
+            field.stateChanged(field.machine.current_state)
+        field.time_at_current_state = int(arrays["field_time"][index])
+        field.time_at_prev_healthy_state = int(arrays["field_prev_healthy"][index])
+        field.steps_in_dehydrated_state = int(arrays["field_dehydrated"][index])
+        field.steps_in_sick_state = int(arrays["field_sick"][index])
+        field.steps_in_weeds_state = int(arrays["field_weeds"][index])
+        field.water_level = int(arrays["field_water"][index])
+        field.taken = 0 if newFleet else int(arrays["field_taken"][index])
+
+        perception = knowledge.perceptionAgents[field.unique_id]
+        perception.state = PassiveAgentStateMachine.states_map[STATE_NAMES[arrays["perception_state"][index]]]
+        knowledge.perceivedCodes[index] = arrays["perception_state"][index]
+        perception.time_at_current_state = int(arrays["perception_time"][index])
+        perception.taken = 0 if newFleet else int(arrays["perception_taken"][index])
+
+    farm = model.farmObject
+    farm.food = meta["food"]
+    farm.inventory[:] = arrays["farm_inventory"]
+    farm.checkouts[:] = arrays["farm_checkouts"]
+    farm.returns[:] = arrays["farm_returns"]
+    farm.stockouts[:] = arrays["farm_stockouts"]
+
+    saved = len(arrays["robot_pos"])
+    for number, robot in enumerate(robots[:saved]):
+        model.grid.move_agent(robot, tuple(int(value) for value in arrays["robot_pos"][number]))
+        if newFleet:
+            continue
+        tool = int(arrays["robot_tool"][number])
+        robot.current_tool = TOOLS[tool] if tool >= 0 else None
+        robot.stepCount, robot.recalculateHeur, robot.search, coordinationCheck = (
+            int(value) for value in arrays["robot_flags"][number])
+        if hasattr(robot, "coordinationCheck"):
+            robot.coordinationCheck = coordinationCheck
+        robot.fieldsToAttend = list()
+        knowledge.cancelPlan(robot.unique_id)
+
+    # Robots dropped by the overrides (all saved robots for a new fleet) return their tool and release the fields
+    # they were heading for
+    kept = 0 if newFleet else len(robots)
+    for tool in arrays["robot_tool"][kept:]:
+        if tool >= 0:
+            farm.inventory[tool] += 1
+
+    for (number, kind, index, integer), score in zip(arrays["attend"], arrays["attend_score"]):
+        if number >= kept:
+            if kind != FARM:
+                fields[index].taken = 0
+                knowledge.perceptionAgents[fields[index].unique_id].taken = 0
+            continue
+        score = int(score) if integer else float(score)
+        if kind == FARM:
+            target = farm
+        elif kind == FIELD:
+            target = fields[index]
+        else:
+            target = knowledge.perceptionAgents[fields[index].unique_id]
+        robots[number].fieldsToAttend.append((score, target))
+
+    model.schedule._plan_agents = list()
+    for number, x, y, steps_left in arrays["plans"]:
+        if number >= kept:
+            continue
+        plan = ActiveAgentPlanning(robots[number], (int(x), int(y)), int(steps_left))
+        knowledge.update(plan)
+        model.schedule.add(plan)
+
+    collector = model.datacollector
+    restoreColumn(collector.model_steps, arrays["model_steps"])
+    for name, column in collector.model_vars.items():
+        # Columns that were not saved (e.g. timing) have no value for the steps before the checkpoint
+        restoreColumn(column, arrays.get("model_" + name, numpy.full(len(arrays["model_steps"]), None)))
+    restoreColumn(collector.agent_steps, arrays["agent_steps"])
+    restoreColumn(collector.agent_ids, arrays["agent_ids"])
+    for name in meta["agent_columns"]:
+        restoreColumn(collector.agent_vars[name], arrays["agent_" + name])
+    collector.last_agent_rows = {uid: tuple(row) for uid, row in meta["last_agent_rows"]}
+    collector.last_model_row = tuple(meta["last_model_row"]) if meta["last_model_row"] is not None else None
+    collector.model_dataframe = None
+    collector.agent_dataframe = None
+
+    return model
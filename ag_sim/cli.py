@@ -0,0 +1,178 @@
+import argparse
+import json
+import sys
+import time
+
+'''
+*** Headless command line runner: runs AgSimulator without the visualization and streams the runs to a ResultsStore
+*** Only the model and the results store are imported (no mesa visualization, tornado or pandas), so a short run
+*** starts quickly; launch it as python run_headless.py or python -m ag_sim.cli
+*** The model parameters are DEFAULT_PARAMS, updated with the "params" of a JSON config file (--config) and then with
+*** --param name=value flags (values are read as JSON, anything else is a string)
+*** The config file can set the other options too (steps, seed, replicates, store, ...); flags override it
+*** A single run reports its progress per step; replicates (or --processes) run as a sweep (see ag_sim/sweep.py)
+*** Example:
+        python run_headless.py --steps 2000 --param active_agents=12 --param "com_protocol=Simple protocol"
+'''
+
+# The defaults of the browser (see model_params in ag_sim/server.py)
+DEFAULT_PARAMS = {
+    "active_agents": 6,
+    "com_protocol": "Helper-Based protocol",
+    "central_allocation": False,
+    "max_water_level": 750,
+    "max_steps_dehydrated": 500,
+    "max_steps_sick": 500,
+    "max_steps_weeds": 500,
+    "seed_sick_probability": 0.0005,
+    "seed_weeds_probability": 0.0005,
+    "steps_seed_to_growing": 1000,
+    "growing_sick_probability": 0.0005,
+    "growing_weeds_probability": 0.0005,
+    "steps_growing_to_flowering": 1000,
+    "flowering_sick_probability": 0.0005,
+    "flowering_weeds_probability": 0.0005,
+    "steps_flowering_to_harvestable": 1000,
+    "harvestable_sick_probability": 0.0005,
+    "harvestable_weeds_probability": 0.0005,
+    "steps_harvestable_to_dead": 500,
+}
+
+# Options that the config file can set, with their defaults
+DEFAULT_OPTIONS = {
+    "steps": 4800,
+    "seed": 0,
+    "replicates": 1,
+    "processes": None,
+    "store": "results_headless",
+    "run_id": None,
+    "columns": None,
+    "cache": None,
+    "replay_interval": None,
+    "stop_when_settled": True,
+    "quiet": False,
+}
+
+
+def parseValue(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def parseParam(text):
+    name, separator, value = text.partition("=")
+    if not separator:
+        raise argparse.ArgumentTypeError("expected name=value, got " + repr(text))
+    return name, parseValue(value)
+
+
+def argumentParser():
+    parser = argparse.ArgumentParser(description="Run the agriculture simulation without visualization")
+    parser.add_argument("--config", help="JSON file with the model parameters (\"params\") and options")
+    parser.add_argument("--param", type=parseParam, action="append", default=[], metavar="NAME=VALUE",
+                        help="model parameter (repeatable)")
+    parser.add_argument("--steps", type=int, help="number of steps per run")
+    parser.add_argument("--seed", type=int, help="seed of the run (base seed of the replicates)")
+    parser.add_argument("--replicates", type=int, help="number of runs")
+    parser.add_argument("--processes", type=int, help="size of the process pool for replicates")
+    parser.add_argument("--store", help="results store directory")
+    parser.add_argument("--run-id", dest="run_id", help="id of a single run in the store")
+    parser.add_argument("--columns", type=lambda text: text.split(","), help="comma separated model reporters")
+    parser.add_argument("--cache", help="result cache directory for replicates (see ag_sim/cache.py)")
+    parser.add_argument("--replay-interval", dest="replay_interval", type=int,
+                        help="record a replay log with a keyframe every REPLAY_INTERVAL steps (single runs)")
+    parser.add_argument("--no-stop-when-settled", dest="stop_when_settled", action="store_const", const=False,
+                        help="simulate every step, also after the run has settled")
+    parser.add_argument("--quiet", action="store_const", const=True, help="no progress output")
+    return parser
+
+
+# Model parameters and options of the command line arguments
+def readConfig(args):
+    config = {}
+    if args.config is not None:
+        with open(args.config) as file:
+            config = json.load(file)
+    params = dict(DEFAULT_PARAMS, **config.get("params", {}))
+    params.update(args.param)
+    options = {name: config.get(name, default) for name, default in DEFAULT_OPTIONS.items()}
+    options.update({name: value for name, value in vars(args).items() if name in options and value is not None})
+    return params, options
+
+
+'''
+*** StepProgress writes the progress of a run to stderr (on one line), at most every interval seconds:
+    step, percentage, steps per second and the estimated time left
+'''
+
+
+class StepProgress():
+
+    def __init__(self, stream=sys.stderr, interval=0.5):
+        self.stream = stream
+        self.interval = interval
+        self.start = time.perf_counter()
+        self.last = 0.0
+
+    def __call__(self, step, steps):
+        now = time.perf_counter()
+        if now - self.last < self.interval and step < steps:
+            return
+        self.last = now
+        rate = step / max(now - self.start, 1e-9)
+        self.stream.write("\rStep {}/{} ({:.0%}), {:.0f} steps/s, {:.0f}s left ".format(
+            step, steps, step / steps, rate, (steps - step) / max(rate, 1e-9)))
+        if step == steps:
+            self.stream.write("\n")
+        self.stream.flush()
+
+
+def printRunProgress(done, total, entry):
+    sys.stderr.write("[{}/{}] {} ({:.1f}s)\n".format(done, total, entry["run"], entry["seconds"]))
+
+
+# One line of JSON with the final values per run, on stdout
+def printResults(store, entries):
+    for entry in entries:
+        final = {column: store.column(entry["run"], column)[-1].item() for column in entry["columns"]}
+        print(json.dumps(dict(run=entry["run"], **final)))
+
+
+def main(argv=None):
+    params, options = readConfig(argumentParser().parse_args(argv))
+    from ag_sim.results import ResultsStore
+
+    store = ResultsStore(options["store"])
+    if options["replicates"] == 1 and options["processes"] in (None, 1):
+        from ag_sim.model import AgSimulator
+
+        start = time.perf_counter()
+        model = AgSimulator(seed=options["seed"], **params)
+        entry = store.write_model(model, options["steps"], {"params": params, "seed": options["seed"]},
+                                  options["run_id"], columns=options["columns"],
+                                  stop_when_settled=options["stop_when_settled"],
+                                  replay_interval=options["replay_interval"],
+                                  progress=None if options["quiet"] else StepProgress())
+        entry["seconds"] = time.perf_counter() - start
+        entries = [entry]
+    else:
+        from ag_sim.sweep import COLUMNS, SweepError, runSweep
+
+        try:
+            entries = runSweep(store, params, {}, options["replicates"], options["steps"],
+                               columns=options["columns"] or COLUMNS, processes=options["processes"],
+                               base_seed=options["seed"], progress=None if options["quiet"] else printRunProgress,
+                               cache=options["cache"], stop_when_settled=options["stop_when_settled"])
+        except SweepError as error:
+            # Report the runs that finished, then exit with the error (on stderr, exit code 1)
+            printResults(store, error.entries)
+            raise SystemExit(str(error))
+
+    printResults(store, entries)
+    return entries
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+from numbers import Integral, Real
+from operator import attrgetter
+import numpy
+
+'''
+*** ColumnarDataCollector collects model and agent data into preallocated numpy arrays (one column per reporter)
+*** It has the same interface as mesa's DataCollector (collect, get_model_vars_dataframe, get_agent_vars_dataframe)
+*** and adds:
+                - agent_types: only agents of these classes are recorded (None records every scheduled agent)
+                - interval: only every interval-th step of the schedule is recorded
+                - on_change: a row is only recorded when its values differ from the last recorded row
+                  (per agent for the agent reporters)
+*** DataFrames are only built when requested, and cached until the next recorded row
+*** (pandas is only imported then, so headless runs start without it)
+'''
+
+
+# dtype of the column needed to store value: integers, other real numbers, or anything else
+def columnType(value):
+    if isinstance(value, Integral):
+        return int
+    if isinstance(value, Real):
+        return float
+    return object
+
+
+# A growable column, stored in a numpy array that doubles in size when full
+# The dtype follows the values: int, widened to float or object when such a value is appended
+class Column():
+
+    def __init__(self, capacity=1024):
+        self.values = None
+        self.size = 0
+        self.capacity = capacity
+
+    def append(self, value):
+        dtype = columnType(value)
+        if self.values is None:
+            self.values = numpy.empty(self.capacity, dtype=dtype)
+        else:
+            if self.size == len(self.values):
+                self.values = numpy.concatenate(
+                    (self.values, numpy.empty(len(self.values), dtype=self.values.dtype)))
+            if self.values.dtype != object and (dtype is object or (dtype is float and self.values.dtype == int)):
+                self.values = self.values.astype(dtype)
+        self.values[self.size] = value
+        self.size += 1
+
+    def array(self):
+        if self.values is None:
+            return numpy.empty(0)
+        return self.values[:self.size]
+
+
+class ColumnarDataCollector():
+
+    def __init__(self, model_reporters=None, agent_reporters=None, agent_types=None, interval=1, on_change=False,
+                 capacity=1024):
+        self.model_reporters = {name: self.reporter(
+            function) for name, function in (model_reporters or {}).items()}
+        self.agent_reporters = {name: self.reporter(
+            function) for name, function in (agent_reporters or {}).items()}
+        self.agent_types = tuple(agent_types) if agent_types else None
+        self.interval = interval
+        self.on_change = on_change
+
+        self.model_steps = Column(capacity)
+        self.model_vars = {name: Column(capacity)
+                           for name in self.model_reporters}
+        self.agent_steps = Column(capacity)
+        self.agent_ids = Column(capacity)
+        self.agent_vars = {name: Column(capacity)
+                           for name in self.agent_reporters}
+
+        self.last_model_row = None
+        self.last_agent_rows = {}
+        self.model_dataframe = None
+        self.agent_dataframe = None
+
+    # Reporters are functions or attribute names, as in mesa's DataCollector
+    @staticmethod
+    def reporter(function):
+        if isinstance(function, str):
+            return attrgetter(function)
+        return function
+
+    def agents(self, model):
+        if self.agent_types is None:
+            return model.schedule.agents
+        return [agent for agent in model.schedule.agents if isinstance(agent, self.agent_types)]
+
+    def collect(self, model):
+        step = model.schedule.steps
+        if step % self.interval != 0:
+            return
+
+        if self.model_reporters:
+            row = tuple(function(model)
+                        for function in self.model_reporters.values())
+            if not self.on_change or row != self.last_model_row:
+                self.model_steps.append(step)
+                for column, value in zip(self.model_vars.values(), row):
+                    column.append(value)
+                self.last_model_row = row
+                self.model_dataframe = None
+
+        if self.agent_reporters:
+            for agent in self.agents(model):
+                row = tuple(function(agent)
+                            for function in self.agent_reporters.values())
+                if self.on_change and self.last_agent_rows.get(agent.unique_id) == row:
+                    continue
+                self.agent_steps.append(step)
+                self.agent_ids.append(agent.unique_id)
+                for column, value in zip(self.agent_vars.values(), row):
+                    column.append(value)
+                self.last_agent_rows[agent.unique_id] = row
+                self.agent_dataframe = None
+
+    # Model data, one row per recorded step, indexed by step
+    def get_model_vars_dataframe(self):
+        import pandas as pd
+
+        if self.model_dataframe is None:
+            index = pd.Index(self.model_steps.array().astype(int), name="Step")
+            self.model_dataframe = pd.DataFrame(
+                {name: column.array() for name, column in self.model_vars.items()}, index=index)
+        return self.model_dataframe.copy()
+
+    # Agent data, one row per recorded agent and step, indexed by (Step, AgentID)
+    def get_agent_vars_dataframe(self):
+        import pandas as pd
+
+        if self.agent_dataframe is None:
+            index = pd.MultiIndex.from_arrays((self.agent_steps.array().astype(int),
+                                               self.agent_ids.array().astype(int)), names=("Step", "AgentID"))
+            self.agent_dataframe = pd.DataFrame(
+                {name: column.array() for name, column in self.agent_vars.items()}, index=index)
+        return self.agent_dataframe.copy()
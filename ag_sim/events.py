@@ -0,0 +1,37 @@
+import numpy
+
+'''
+*** CropEventStream gives the random numbers of the crop events (getting sick, getting weeds) per field and step
+*** With the crop_event_seed model parameter, every PassiveAgent draws its events from this stream instead of the
+*** model's random generator: the number for a field, step and event only depends on the seed, so runs with the same
+*** seed and another protocol or number of robots see the same crop events (common random numbers)
+*** Comparisons between configurations (e.g. protocols) then need far fewer replicates, as the crop randomness
+*** cancels out of the differences
+*** The numbers are generated in blocks of block steps for all fields at once, each block from its own seed sequence,
+*** so a block can be generated without the ones before it (e.g. when resuming a checkpoint)
+'''
+
+# Events of a field
+SICK, WEEDS = 0, 1
+
+
+class CropEventStream():
+
+    def __init__(self, seed, fields, block=128):
+        self.seed = seed
+        self.fields = fields
+        self.block = block
+        self.start = None
+        self.values = None
+
+    def generate(self, start):
+        generator = numpy.random.Generator(numpy.random.PCG64(
+            numpy.random.SeedSequence([self.seed, start // self.block])))
+        self.values = generator.random((self.block, self.fields, 2))
+        self.start = start
+
+    # Uniform number in [0, 1) for the event of the field at step
+    def draw(self, step, index, event):
+        if self.start is None or not self.start <= step < self.start + self.block:
+            self.generate(step - step % self.block)
+        return self.values[step - self.start, index, event]
@@ -0,0 +1,83 @@
+/*
+ * CodeGridModule draws the frames of AgSimCodeGrid (see ag_sim/server.py)
+ * A frame has the base64 encoded uint8 grids field, knowledge and plans (row y, column x) and the robot positions
+ * The codes are drawn as one pixel per cell with the palette, then scaled to the canvas:
+ *      - upper half: the simulation map, with the robots as circles
+ *      - lower half: the knowledge map, with the plans on top
+ * As in the canvas grid (mesa's GridVisualization), row y of a map is drawn upside down, at row height - 1 - y
+ */
+var CodeGridModule = function(canvas_width, canvas_height, grid_width, grid_height, palette) {
+	var canvas_tag = `<canvas width="${canvas_width}" height="${canvas_height}" class="world-grid"/>`
+	var parent_div_tag = '<div style="height:' + canvas_height + 'px;" class="world-grid-parent"></div>'
+
+	var canvas = $(canvas_tag)[0];
+	var parent = $(parent_div_tag)[0];
+	$("#elements").append(parent);
+	parent.append(canvas);
+	var context = canvas.getContext("2d");
+
+	// One pixel per cell, both maps below each other
+	var image = document.createElement("canvas");
+	image.width = grid_width;
+	image.height = grid_height * 2;
+	var imageContext = image.getContext("2d");
+	var pixels = imageContext.createImageData(grid_width, grid_height * 2);
+
+	var cellWidth = canvas_width / grid_width;
+	var cellHeight = canvas_height / (grid_height * 2);
+
+	// RGBA per code
+	var rgba = palette.map(function(color) {
+		var value = parseInt(color.slice(1), 16);
+		return [(value >> 16) & 255, (value >> 8) & 255, value & 255, 255];
+	});
+	var robotColor = palette[palette.length - 1];
+
+	var decode = function(text) {
+		var binary = atob(text);
+		var codes = new Uint8Array(binary.length);
+		for (var i = 0; i < binary.length; i++)
+			codes[i] = binary.charCodeAt(i);
+		return codes;
+	};
+
+	var setPixel = function(offset, code) {
+		var color = rgba[code];
+		pixels.data[offset] = color[0];
+		pixels.data[offset + 1] = color[1];
+		pixels.data[offset + 2] = color[2];
+		pixels.data[offset + 3] = color[3];
+	};
+
+	this.render = function(data) {
+		var field = decode(data.field);
+		var knowledge = decode(data.knowledge);
+		var plans = decode(data.plans);
+		for (var y = 0; y < grid_height; y++) {
+			var row = grid_height - 1 - y;
+			for (var x = 0; x < grid_width; x++) {
+				var i = y * grid_width + x;
+				setPixel(4 * (row * grid_width + x), field[i]);
+				setPixel(4 * ((row + grid_height) * grid_width + x), plans[i] !== 0 ? plans[i] : knowledge[i]);
+			}
+		}
+		imageContext.putImageData(pixels, 0, 0);
+
+		context.clearRect(0, 0, canvas_width, canvas_height);
+		context.imageSmoothingEnabled = false;
+		context.drawImage(image, 0, 0, canvas_width, canvas_height);
+
+		context.fillStyle = robotColor;
+		var radius = Math.max(Math.min(cellWidth, cellHeight) / 2 - 1, 1);
+		for (var r = 0; r < data.robots.length; r += 2) {
+			context.beginPath();
+			context.arc((data.robots[r] + 0.5) * cellWidth, (grid_height - 1 - data.robots[r + 1] + 0.5) * cellHeight,
+			            radius, 0, Math.PI * 2, false);
+			context.fill();
+		}
+	};
+
+	this.reset = function() {
+		context.clearRect(0, 0, canvas_width, canvas_height);
+	};
+};
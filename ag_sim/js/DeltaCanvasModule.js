@@ -0,0 +1,66 @@
+/*
+ * DeltaCanvasModule draws the frames of AgSimGrid with delta=True (see ag_sim/server.py)
+ * A frame is {"keyframe": bool, "cells": [[x, y, portrayals], ...]}:
+ *      - keyframe: the canvas is cleared and every cell is drawn
+ *      - otherwise: only the listed cells are cleared and drawn again (a cell with no portrayals is left empty),
+ *        the rest of the canvas stays as it was
+ */
+var DeltaCanvasModule = function(canvas_width, canvas_height, grid_width, grid_height) {
+	// Create the element (as in CanvasModule)
+	var canvas_tag = `<canvas width="${canvas_width}" height="${canvas_height}" class="world-grid"/>`
+	var parent_div_tag = '<div style="height:' + canvas_height + 'px;" class="world-grid-parent"></div>'
+
+	var canvas = $(canvas_tag)[0];
+	var interaction_canvas = $(canvas_tag)[0];
+	var parent = $(parent_div_tag)[0];
+
+	$("#elements").append(parent);
+	parent.append(canvas);
+	parent.append(interaction_canvas);
+
+	var context = canvas.getContext("2d");
+	var interactionHandler = new InteractionHandler(canvas_width, canvas_height, grid_width, grid_height, interaction_canvas.getContext("2d"));
+	var canvasDraw = new GridVisualization(canvas_width, canvas_height, grid_width, grid_height, context, interactionHandler);
+
+	var cellWidth = Math.floor(canvas_width / grid_width);
+	var cellHeight = Math.floor(canvas_height / grid_height);
+
+	// Portrayals of every cell drawn so far, so the mouseover lookup covers the whole canvas between keyframes
+	var cellPortrayals = {};
+
+	this.render = function(data) {
+		if (data.keyframe) {
+			canvasDraw.resetCanvas();
+			cellPortrayals = {};
+		}
+		var portrayals = [];
+		for (var i = 0; i < data.cells.length; i++) {
+			var cell = data.cells[i];
+			// Row y of the model is drawn at row gridHeight - y - 1 of the canvas (as in GridVisualization.drawLayer)
+			if (!data.keyframe)
+				context.clearRect(cell[0] * cellWidth, (grid_height - cell[1] - 1) * cellHeight, cellWidth, cellHeight);
+			cellPortrayals[cell[0] + "," + cell[1]] = cell[2];
+			Array.prototype.push.apply(portrayals, cell[2]);
+		}
+		canvasDraw.drawLayer(portrayals);
+		canvasDraw.drawGridLines("#eee");
+
+		// drawLayer only registered the cells of this frame: register all cells again
+		// (drawLayer already turned the y of the portrayals into canvas rows)
+		var all = [];
+		interactionHandler.mouseoverLookupTable.init();
+		for (var key in cellPortrayals) {
+			var cellList = cellPortrayals[key];
+			for (var j = 0; j < cellList.length; j++) {
+				interactionHandler.mouseoverLookupTable.set(cellList[j].x, cellList[j].y, all.length);
+				all.push(cellList[j]);
+			}
+		}
+		interactionHandler.updateMouseListeners(all);
+	};
+
+	this.reset = function() {
+		canvasDraw.resetCanvas();
+		cellPortrayals = {};
+	};
+};
@@ -0,0 +1,64 @@
+/*
+ * MinMaxChartModule draws the frames of MinMaxChart (see ag_sim/charts.py)
+ * Every series is a band between the minimum and maximum of its values per bucket of width steps
+ * A frame has the buckets from start on (min and max per series); the chart is cleared first when reset is set
+ */
+var MinMaxChartModule = function(series, canvas_width, canvas_height) {
+	var canvas = $("<canvas width='" + canvas_width + "' height='" + canvas_height + "' style='border:1px dotted'></canvas>")[0];
+	$("#elements").append(canvas);
+	var context = canvas.getContext("2d");
+
+	var transparent = function(hex) {
+		var value = parseInt(hex.slice(1), 16);
+		return "rgba(" + ((value >> 16) & 255) + "," + ((value >> 8) & 255) + "," + (value & 255) + ",0.3)";
+	};
+
+	// Two datasets per series: the maximum (with the label) and the minimum (filled up to the maximum)
+	var datasets = [];
+	series.forEach(function(s) {
+		datasets.push({label: s.Label, borderColor: s.Color, backgroundColor: s.Color, fill: false,
+		               pointRadius: 0, borderWidth: 1, data: []});
+		datasets.push({label: "", borderColor: s.Color, backgroundColor: transparent(s.Color), fill: "-1",
+		               pointRadius: 0, borderWidth: 1, data: []});
+	});
+
+	var chart = new Chart(context, {
+		type: "line",
+		data: {datasets: datasets},
+		options: {
+			responsive: true,
+			animation: {duration: 0},
+			spanGaps: true,
+			legend: {labels: {filter: function(item) { return item.text !== ""; }}},
+			tooltips: {mode: "nearest", intersect: false},
+			scales: {
+				xAxes: [{type: "linear", display: true, scaleLabel: {display: true, labelString: "Step"}}],
+				yAxes: [{display: true}]
+			}
+		}
+	});
+
+	var clear = function() {
+		chart.data.datasets.forEach(function(dataset) { dataset.data.length = 0; });
+	};
+
+	this.render = function(data) {
+		if (data.reset)
+			clear();
+		for (var i = 0; i < series.length; i++) {
+			var maxima = chart.data.datasets[2 * i].data;
+			var minima = chart.data.datasets[2 * i + 1].data;
+			for (var k = 0; k < data.max[i].length; k++) {
+				var bucket = data.start + k;
+				maxima[bucket] = {x: bucket * data.width, y: data.max[i][k]};
+				minima[bucket] = {x: bucket * data.width, y: data.min[i][k]};
+			}
+		}
+		chart.update();
+	};
+
+	this.reset = function() {
+		clear();
+		chart.update();
+	};
+};
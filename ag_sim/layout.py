@@ -0,0 +1,121 @@
+import numpy
+
+'''
+*** FarmLayout is the geometry of the farm, shared by the model grid, the AgentKnowledgeMap, the path engine (astar.py)
+*** and the visualization (ag_sim/server.py)
+*** It is kept as compact arrays, so a layout of 10^6 cells only costs a few megabytes:
+                - fieldPositions: n x 2 array with the (x, y) of every crop field, in x-major order (the field index
+                  of the AgentKnowledgeMap)
+                - walls: height x width uint8 array (row y, column x), 1 where the robots cannot drive (crop fields
+                  and obstacles)
+                - headlands: the road rows that cross the whole farm, used for the road distances (see
+                  targeting.roadDistance)
+                - depot: the position of the FarmAgent
+*** The model takes the layout from the "layout" model parameter: a dictionary with the arguments of generateLayout
+*** (without width and height, which are the grid size of the model), so it stays JSON serializable for the results
+*** store, the cache and the checkpoints; without it, defaultLayout is used
+'''
+
+
+class FarmLayout():
+
+    def __init__(self, width, height, fieldPositions, walls, headlands, depot):
+        self.width = width
+        self.height = height
+        self.fieldPositions = fieldPositions
+        self.walls = walls
+        self.headlands = tuple(headlands)
+        self.depot = tuple(depot)
+
+    def inside(self, pos):
+        return 0 <= pos[0] < self.width and 0 <= pos[1] < self.height
+
+    def isFree(self, pos):
+        return self.inside(pos) and self.walls[pos[1], pos[0]] == 0
+
+    # The free cells from which a robot can attend the field (or the depot) at pos: left, right, and the headland
+    # above or below the first and last field of a column
+    def approaches(self, pos):
+        x, y = pos
+        cells = [(x - 1, y), (x + 1, y)] + [(x, row) for row in (y - 1, y + 1) if row in self.headlands]
+        return [cell for cell in cells if self.isFree(cell)]
+
+    # Starting positions of count robots: the free cells of the column right of the depot, upwards from the depot row
+    # and then downwards below it
+    def robotPositions(self, count):
+        x = self.depot[0] + 1
+        rows = list(range(self.depot[1], -1, -1)) + list(range(self.depot[1] + 1, self.height))
+        cells = [(x, y) for y in rows if self.isFree((x, y))]
+        if count > len(cells):
+            raise ValueError("The layout has room for {} robots next to the depot, {} requested".format(
+                len(cells), count))
+        return cells[:count]
+
+
+'''
+*** generateLayout creates a FarmLayout of crop columns separated by driving lanes
+    Inputs:
+           - width, height: size of the grid
+           - column_spacing: distance between two crop columns (2 leaves one lane between the columns)
+           - first_column: x of the first crop column
+           - headland_rows: number of road rows at the top and bottom of the farm and between the blocks
+           - blocks: number of blocks the crop columns are split into from top to bottom
+           - depot: position of the farm (default: (width - 3, height - 2))
+           - depot_columns: number of columns on the right without crops, where the depot and the robots are
+           - obstacles: rectangles [x, y, w, h] of cells the robots cannot drive over (crops under them are removed)
+'''
+
+
+def generateLayout(width=50, height=50, column_spacing=2, first_column=1, headland_rows=1, blocks=1, depot=None,
+                   depot_columns=4, obstacles=()):
+    if column_spacing < 1 or headland_rows < 1 or blocks < 1:
+        raise ValueError("column_spacing, headland_rows and blocks must be at least 1")
+
+    # Crop rows of every block, separated by headland rows
+    rows = height - (blocks + 1) * headland_rows
+    if rows < blocks:
+        raise ValueError("A height of {} leaves no crop rows for {} blocks".format(height, blocks))
+    block_rows, extra = divmod(rows, blocks)
+    crop_rows = list()
+    top = headland_rows
+    for block in range(blocks):
+        size = block_rows + (block < extra)
+        crop_rows.extend(range(top, top + size))
+        top += size + headland_rows
+    columns = numpy.arange(first_column, width - depot_columns, column_spacing)
+
+    crops = numpy.zeros((height, width), dtype=numpy.uint8)
+    crops[numpy.ix_(crop_rows, columns)] = 1
+    blocked = numpy.zeros_like(crops)
+    for x, y, w, h in obstacles:
+        blocked[max(y, 0):max(y + h, 0), max(x, 0):max(x + w, 0)] = 1
+    crops &= 1 - blocked
+
+    # x-major order: numpy.nonzero walks the transposed array column by column
+    xs, ys = numpy.nonzero(crops.T)
+    fieldPositions = numpy.stack((xs, ys), axis=1)
+    headlands = sorted(set(range(height)) - set(crop_rows))
+
+    depot = (width - 3, height - 2) if depot is None else tuple(depot)
+    layout = FarmLayout(width, height, fieldPositions, crops | blocked, headlands, depot)
+    if not layout.isFree(depot):
+        raise ValueError("The depot {} is not on a free cell".format(depot))
+    return layout
+
+
+'''
+*** defaultLayout is the layout of the original 50x50 farm, for any grid size: crop columns at the odd x, one headland
+*** row at the top and bottom, the depot at (width - 3, height - 2) and the two obstacles of the original maze (the
+*** cell at (width - 3, 1) and the column at x = width - 1 along the crop rows)
+*** layoutFromParams creates the layout of the "layout" model parameter
+'''
+
+
+def defaultLayout(width=50, height=50):
+    return generateLayout(width, height, obstacles=[(width - 3, 1, 1, 1), (width - 1, 1, 1, height - 2)])
+
+
+def layoutFromParams(width, height, params=None):
+    if params is None:
+        return defaultLayout(width, height)
+    return generateLayout(width, height, **params)
@@ -0,0 +1,121 @@
+import threading
+import time
+import tornado.escape
+from mesa.visualization.ModularVisualization import ModularServer, SocketHandler
+from mesa.visualization.modules import TextElement
+
+'''
+*** BackgroundServer is a ModularServer whose model runs in a background thread instead of one step per browser request
+*** The browser keeps asking for frames at its frames per second setting; every request returns the state the model
+*** has reached by then, so the model runs at full speed and the frames only sample it
+                - frame_every: the model stops at every frame_every-th step until the browser has taken that frame,
+                  so exactly every frame_every-th step is shown (None shows the latest step)
+                - idle_timeout: the model only runs for idle_timeout seconds after the last request, so it pauses
+                  (and never runs ahead without a viewer) when the browser stops asking
+*** The model and the renders share a lock, so a frame is always rendered between two steps
+'''
+
+
+class ModelRunner():
+
+    def __init__(self, model, frame_every=None, idle_timeout=2.0):
+        self.model = model
+        self.frame_every = frame_every
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.deadline = 0
+        self.waiting = False
+        self.stopped = False
+        self.rendered = None
+        self.started = time.perf_counter()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        with self.lock:
+            while not self.stopped and self.model.running:
+                now = time.monotonic()
+                if now >= self.deadline:
+                    self.wakeup.wait(self.idle_timeout)
+                    continue
+                # Backpressure: wait for the browser to take the frame of this step
+                if self.frame_every is not None and self.waiting:
+                    self.wakeup.wait(self.deadline - now)
+                    continue
+                self.model.step()
+                if self.frame_every is not None and self.model.schedule.steps % self.frame_every == 0:
+                    self.waiting = True
+                # Let the renders in between the steps
+                self.lock.release()
+                self.lock.acquire()
+
+    # Render the current state with render() and let the model run on
+    def frame(self, render):
+        with self.lock:
+            data = render()
+            self.rendered = self.model.schedule.steps
+            self.waiting = False
+            self.deadline = time.monotonic() + self.idle_timeout
+            self.wakeup.notify_all()
+        return data
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+            self.wakeup.notify_all()
+        self.thread.join()
+
+    # True once the model stopped and its last step was shown
+    def ended(self):
+        with self.lock:
+            return not self.model.running and self.rendered == self.model.schedule.steps
+
+    def steps_per_second(self):
+        return self.model.schedule.steps / max(time.perf_counter() - self.started, 1e-9)
+
+
+class BackgroundSocketHandler(SocketHandler):
+
+    def on_message(self, message):
+        application = self.application
+        msg = tornado.escape.json_decode(message)
+        if msg["type"] == "get_step":
+            if application.runner.ended():
+                self.write_message({"type": "end"})
+            else:
+                self.write_message({"type": "viz_state", "data": application.runner.frame(application.render_model)})
+        elif msg["type"] == "reset":
+            application.reset_model()
+            self.write_message({"type": "viz_state", "data": application.runner.frame(application.render_model)})
+        else:
+            super().on_message(message)
+
+
+class BackgroundServer(ModularServer):
+    socket_handler = (r"/ws", BackgroundSocketHandler)
+    handlers = [ModularServer.page_handler, socket_handler,
+                ModularServer.static_handler, ModularServer.local_handler]
+
+    def __init__(self, model_cls, visualization_elements, name="Mesa Model", model_params={}, frame_every=None,
+                 idle_timeout=2.0):
+        self.frame_every = frame_every
+        self.idle_timeout = idle_timeout
+        self.runner = None
+        super().__init__(model_cls, [StepText(self)] + list(visualization_elements), name, model_params)
+
+    def reset_model(self):
+        if self.runner is not None:
+            self.runner.stop()
+        super().reset_model()
+        self.runner = ModelRunner(self.model, self.frame_every, self.idle_timeout)
+
+
+# Shows the step the model has reached and its speed, as the step counter of the page counts frames
+class StepText(TextElement):
+    def __init__(self, server):
+        self.server = server
+
+    def render(self, model):
+        runner = self.server.runner
+        return "Model step: {} ({:.0f} steps/s)".format(model.schedule.steps, runner.steps_per_second())
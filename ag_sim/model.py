@@ -1,17 +1,39 @@
 from mesa import Model
-from mesa.space import SingleGrid, MultiGrid
-from mesa.datacollection import DataCollector
+from ag_sim.datacollection import ColumnarDataCollector
 from ag_sim.schedule import ActivePassiveAgentActivation
 from ag_sim.agents import ActiveAgent, PassiveAgent, PassiveAgentPerception, ActiveAgentPlanning, FarmAgent
+from ag_sim.timing import NO_TIMER, StageTimer
+from ag_sim.allocation import TaskAllocator
+from ag_sim.states import STATE_NAMES, STATE_CODES, TOOLS, TOOL_IDS, TOOL_MASKS, TERMINAL_MASK
+from ag_sim.targeting import stateLimits
+from ag_sim.checkpoint import saveCheckpoint, loadCheckpoint
+from ag_sim.events import CropEventStream
+from ag_sim.replay import ReplayRecorder
+from ag_sim.layout import layoutFromParams
+from ag_sim.space import SparseGrid, SparseMultiGrid
 from collections import defaultdict
 import numpy
 
 '''
 *** AgentKnowledgeMap is a common knowledge object for ActiveAgents to update during passive_stage
 *** AgentKnowledgeMap.navigationGrid:
-                                        Tracks all the objects seen by ActiveAgents
+                                        Tracks all the objects seen by ActiveAgents (the grids are sparse, see ag_sim/space.py)
 *** AgentKnowledgeMap.planGrid:
                                         Tracks the plans for ActiveAgents
+*** AgentKnowledgeMap field arrays:
+                                        State code, time at current state and taken flag of every field,
+                                        indexed by PassiveAgent.fieldIndex; used to score all fields at once
+*** AgentKnowledgeMap.subscribers:
+                                        ActiveAgents subscribed to field state changes, per state code
+*** AgentKnowledgeMap.perceivedCodes:
+                                        State code of every field as perceived by the ActiveAgents (navigationGrid)
+*** AgentKnowledgeMap.stateCounts:
+                                        Number of fields per state code; settled() is True once every field is
+                                        in a terminal state (harvested or dead)
+*** AgentKnowledgeMap.untakenCounts / untakenTimes:
+                                        Number of fields and sum of their times at current state per state code,
+                                        for the fields that are not taken; kept up to date on every field change
+                                        and used for the demand of every tool (toolDemand)
 
 
 *** AgentKnowledgeMap.getGridStateAtStep(step):
@@ -24,6 +46,7 @@ class AgentKnowledgeMap():
     *** Constructor:
         Inputs:
                - height and width of the grid used by the AgSimulator
+               - limits: maximum number of steps per state code (see targeting.stateLimits), used for toolDemand
 
        Actions:
                - Construct navigationGrid
@@ -31,9 +54,9 @@ class AgentKnowledgeMap():
                - Create agent dictionaries
     '''
 
-    def __init__(self, height, width, model):
-        self.navigationGrid = SingleGrid(height, width, False)
-        self.planGrid = MultiGrid(height, width, False)
+    def __init__(self, height, width, model, limits=None):
+        self.navigationGrid = SparseGrid(width, height, False)
+        self.planGrid = SparseMultiGrid(width, height, False)
         self.planAgents = defaultdict(list)
         self.perceptionAgents = {}
         self.model = model
@@ -41,6 +64,141 @@ class AgentKnowledgeMap():
         self.navigationGrid.place_agent(agent, self.model.farmPos)
         self.attendancePoints = list()
 
+        # Field arrays (see allocateFields)
+        self.fieldAgents = list()
+        self.fieldIndexAt = {}
+        self.fieldPositions = numpy.zeros((0, 2), dtype=int)
+        self.stateCodes = numpy.zeros(0, dtype='int8')
+        self.perceivedCodes = numpy.zeros(0, dtype='int8')
+        self.stateTimes = numpy.zeros(0, dtype=int)
+        self.taken = numpy.zeros(0, dtype='int8')
+        self.subscribers = [list() for _ in STATE_NAMES]
+        self.limits = limits if limits is not None else stateLimits(1, 1, 1)
+        self.stateCounts = numpy.zeros(len(STATE_NAMES), dtype=int)
+        self.untakenCounts = numpy.zeros(len(STATE_NAMES), dtype=int)
+        self.untakenTimes = numpy.zeros(len(STATE_NAMES), dtype=int)
+
+    '''
+    *** allocateFields creates the field arrays for the given field positions
+    *** registerField registers a single PassiveAgent built with its constructor and returns its index in the field
+        arrays; registerFields registers the new PassiveAgents of all positions at once (see PassiveAgent.createFields)
+    *** updateField, updateFieldTime and updateFieldTaken are called by a PassiveAgent when its state,
+        time at current state or taken flag changes
+    '''
+
+    def allocateFields(self, positions):
+        self.fieldAgents = [None] * len(positions)
+        self.fieldIndexAt = {tuple(pos): index for index,
+                             pos in enumerate(positions)}
+        self.fieldPositions = numpy.array(positions, dtype=int).reshape(-1, 2)
+        self.stateCodes = numpy.zeros(len(positions), dtype='int8')
+        self.perceivedCodes = numpy.zeros(len(positions), dtype='int8')
+        self.stateTimes = numpy.zeros(len(positions), dtype=int)
+        self.taken = numpy.zeros(len(positions), dtype='int8')
+        self.stateCounts[:] = 0
+        self.untakenCounts[:] = 0
+        self.untakenTimes[:] = 0
+
+    def registerField(self, agent):
+        index = self.fieldIndexAt[agent.pos]
+        self.fieldAgents[index] = agent
+        self.stateCodes[index] = STATE_CODES[agent.machine.current_state.value]
+        self.stateCounts[self.stateCodes[index]] += 1
+        self.countField(index, 1)
+        self.notify(index, None, self.stateCodes[index])
+        return index
+
+    # The agents are new (time at current state 0, not taken) and in the order of the positions of allocateFields
+    def registerFields(self, agents):
+        self.fieldAgents = list(agents)
+        self.stateCodes[:] = [STATE_CODES[agent.machine.current_state.value] for agent in agents]
+        counts = numpy.bincount(self.stateCodes, minlength=len(STATE_NAMES))
+        self.stateCounts += counts
+        self.untakenCounts += counts
+        for code in numpy.flatnonzero(counts):
+            indices = numpy.flatnonzero(self.stateCodes == code)
+            for agent in self.subscribers[code]:
+                agent.targetSet.update(indices.tolist())
+                agent.targetsChanged = True
+
+    def updateField(self, index, state):
+        old = self.stateCodes[index]
+        self.countField(index, -1)
+        self.stateCodes[index] = STATE_CODES[state.value]
+        self.stateCounts[old] -= 1
+        self.stateCounts[self.stateCodes[index]] += 1
+        self.countField(index, 1)
+        self.notify(index, old, self.stateCodes[index])
+
+    def updateFieldTime(self, index, time):
+        self.countField(index, -1)
+        self.stateTimes[index] = time
+        self.countField(index, 1)
+
+    def updateFieldTaken(self, index, taken):
+        self.countField(index, -1)
+        self.taken[index] = taken
+        self.countField(index, 1)
+
+    # Add (sign 1) or remove (sign -1) the field from untakenCounts and untakenTimes
+    def countField(self, index, sign):
+        if self.taken[index] == 0:
+            code = self.stateCodes[index]
+            self.untakenCounts[code] += sign
+            self.untakenTimes[code] += sign * self.stateTimes[index]
+
+    def settled(self):
+        return self.stateCounts[~TERMINAL_MASK].sum() == 0
+
+    '''
+    *** toolDemand returns the demand for every tool (indexed by states.TOOL_IDS), based on the fields that are not taken:
+                - plow: 0.75 per field in start, seeder: 1 per plowed field
+                - irrigator, wacker, sprayer: time at current state / maximum steps in that state, summed over the fields
+                - harvester: 1 if there is a harvestable field
+    '''
+
+    def toolDemand(self):
+        demand = numpy.zeros(len(TOOLS))
+        demand[TOOL_IDS["plow"]] = 0.75 * \
+            self.untakenCounts[STATE_CODES["start"]]
+        demand[TOOL_IDS["seeder"]] = self.untakenCounts[STATE_CODES["plowed"]]
+        for tool in ("irrigator", "wacker", "sprayer"):
+            demand[TOOL_IDS[tool]] = (
+                self.untakenTimes / self.limits)[TOOL_MASKS[tool]].sum()
+        demand[TOOL_IDS["harvester"]] = min(
+            self.untakenCounts[STATE_CODES["harvestable"]], 1)
+        return demand
+
+    '''
+    *** subscribe registers an ActiveAgent for changes of the fields in the states of mask (boolean array over the state codes)
+        Output:
+              - indices of the fields currently in those states
+    *** The agent's fieldEntered(index) / fieldLeft(index) are called when a field enters / leaves those states
+    *** unsubscribe removes all subscriptions of the agent
+    '''
+
+    def subscribe(self, agent, mask):
+        for code in numpy.flatnonzero(mask):
+            self.subscribers[code].append(agent)
+        return numpy.flatnonzero(mask[self.stateCodes])
+
+    def unsubscribe(self, agent):
+        for subscribers in self.subscribers:
+            if agent in subscribers:
+                subscribers.remove(agent)
+
+    def notify(self, index, old, new):
+        if old == new:
+            return
+        before = self.subscribers[old] if old is not None else ()
+        after = self.subscribers[new]
+        for agent in before:
+            if agent not in after:
+                agent.fieldLeft(index)
+        for agent in after:
+            if agent not in before:
+                agent.fieldEntered(index)
+
     '''
     *** update function is used by each ActiveAgent to update ActiveAgentKnowledgeMap
         Input:
@@ -61,6 +219,7 @@ class AgentKnowledgeMap():
                 existing_agent = self.navigationGrid.get_cell_list_contents(agent.pos)[
                     0]
                 existing_agent.update(agent.state, agent.time_at_current_state)
+            self.perceivedCodes[self.fieldIndexAt[agent.pos]] = STATE_CODES[agent.state.value]
 
     # This function is used for removing a step from the KnowledgeMap
     def removeOneStep(self, agentID):
@@ -72,19 +231,19 @@ class AgentKnowledgeMap():
         while len(self.planAgents[agentID]) > 0:
             self.planGrid.remove_agent(self.planAgents[agentID].pop(0))
     '''
-    *** getGridStateAtStep returns a SingleGrid object with anticipated state of the grid at specified steps
+    *** getGridStateAtStep returns a SparseGrid object with anticipated state of the grid at specified steps
         Input:
-              - step for which the SingleGrid should be generated
+              - step for which the SparseGrid should be generated
         Output:
-              - SingleGrid object with PassiveAgentPerception objects and ActiveAgentPlanning objects corresponding to chosen step
+              - SparseGrid object with PassiveAgentPerception objects and ActiveAgentPlanning objects corresponding to chosen step
     '''
 
     def getGridStateAtStep(self, step=0):
         plan_agent_keys = [uid for uid, a in self.planAgents.items()]
         perception_agent_keys = [uid for uid,
                                  a in self.perceptionAgents.items()]
-        navGridAtStep = SingleGrid(
-            self.navigationGrid.height, self.navigationGrid.width, False)
+        navGridAtStep = SparseGrid(
+            self.navigationGrid.width, self.navigationGrid.height, False)
         for key in perception_agent_keys:
             navGridAtStep.place_agent(
                 self.perceptionAgents[key], self.perceptionAgents[key].pos)
@@ -102,7 +261,7 @@ class AgentKnowledgeMap():
         perception_agent_keys = [uid for uid,
                                  a in self.perceptionAgents.items()]
         return_numpy_array = numpy.zeros(
-            (self.navigationGrid.width, self.navigationGrid.height), dtype='int8')
+            (self.navigationGrid.height, self.navigationGrid.width), dtype='int8')
         for key in perception_agent_keys:
             return_numpy_array[self.perceptionAgents[key].pos[1],
                                self.perceptionAgents[key].pos[0]] = 1
@@ -126,7 +285,7 @@ class AgentKnowledgeMap():
 '''
 *** AgSimulator is the main model class for this project
 *** Specifies model parameters:
-                               - grid size
+                               - grid size and farm layout (see ag_sim/layout.py)
                                - number of active Agents
                                more to come...
 '''
@@ -144,9 +303,11 @@ class AgSimulator(Model):
         Inputs:
                - height and width for the grid
                - number of ActiveAgents to place on the grid
+               - layout: arguments of layout.generateLayout for the farm on the grid (the original farm without it)
 
         Actions:
-                - Construct and store SingleGrid for Model.grid
+                - Construct and store the FarmLayout for Model.layout
+                - Construct and store SparseMultiGrid for Model.grid
                 - Construct and store ActivePassiveAgentActivation for Model.schedule
                 - Construct and store datacollector
                 - Construct and store AgentKnowledgeMap
@@ -157,6 +318,31 @@ class AgSimulator(Model):
     def __init__(self, height=50, width=50, **model_params):
         super().__init__()
 
+        # Model.__new__ stores the random generator on the class; keep this model's own generator,
+        # so creating another model (e.g. when loading a checkpoint) does not affect this one
+        self.random = self.random
+        self.fieldAgents = list()
+        self.setup(height, width, model_params)
+
+    '''
+    *** reset starts a new run on this model, as if it was created again with AgSimulator(height, width, seed=seed,
+        **model_params) (the same results for the same seed), but reuses the PassiveAgents of the last run
+    *** Meant for batch runs of many short replicates (see ag_sim/sweep.py), where creating the model is a noticeable
+        share of the time
+    '''
+
+    def reset(self, seed=None, **model_params):
+        height = model_params.pop("height", self.height)
+        width = model_params.pop("width", self.width)
+        self.random.seed(seed)
+        self._seed = seed
+        self.current_id = 0
+        self.setup(height, width, dict(model_params, seed=seed))
+
+    # Everything the constructor does after creating the random generator
+    def setup(self, height, width, model_params):
+        self.model_params = dict(model_params)
+
         # Set a shut off condition (used with the BatchRunner to run multiple experiments)
         self.running = model_params.get("running_condition", True)
 
@@ -169,47 +355,75 @@ class AgSimulator(Model):
         # Set all model parameters from **model_params;
         # second value is the default for when the requested parameter is not set
         self.active_agents = model_params.get("active_agents", 1)
-        self.farmPos = (47, 48)
+
+        # The geometry of the farm: crop fields, roads, obstacles and depot (see ag_sim/layout.py)
+        self.layout = layoutFromParams(width, height, model_params.get("layout"))
+        self.farmPos = self.layout.depot
+
+        # Stop run_model once the run is settled (see settled)
+        self.stop_when_settled = model_params.get("stop_when_settled", False)
+
+        # Optional timing of the model stages and hot functions (see ag_sim/timing.py)
+        self.timer = StageTimer() if model_params.get("timing", False) else None
+
         # Create the schedule
         self.schedule = ActivePassiveAgentActivation(self)
 
         # Create the single grid on which everything happens
         self.height = height
         self.width = width
-        self.grid = MultiGrid(self.height, self.width, False)
+        self.grid = SparseMultiGrid(self.width, self.height, False)
 
         # Specify the data that has to be collected during the run
-        self.datacollector = DataCollector(
-            model_reporters={
-                "harvest_score": self.get_harvest_score,
-                "total_steps_dehydrated": self.get_total_steps_dehydrated,
-                "total_steps_sick": self.get_total_steps_sick,
-                "total_steps_weeds": self.get_total_steps_weeds
-            },
+        model_reporters = {
+            "harvest_score": self.get_harvest_score,
+            "total_steps_dehydrated": self.get_total_steps_dehydrated,
+            "total_steps_sick": self.get_total_steps_sick,
+            "total_steps_weeds": self.get_total_steps_weeds
+        }
+        if self.timer is not None:
+            model_reporters["timing"] = self.get_timing
+        # Only the positions of the ActiveAgents are collected (the other agents do not move);
+        # collect_interval and collect_on_change control how often rows are recorded (see ag_sim/datacollection.py)
+        self.datacollector = ColumnarDataCollector(
+            model_reporters=model_reporters,
             agent_reporters={
                 "X": lambda a: a.pos[0],
                 "Y": lambda a: a.pos[1]
-            }
+            },
+            agent_types=(ActiveAgent,),
+            interval=model_params.get("collect_interval", 1),
+            on_change=model_params.get("collect_on_change", False)
         )
 
         # TODO: Create and object to serve as common knowledge base for active agents
-        self.knowledgeMap = AgentKnowledgeMap(self.height, self.width, self)
+        self.knowledgeMap = AgentKnowledgeMap(self.height, self.width, self, stateLimits(
+            model_params["max_steps_dehydrated"], model_params["max_steps_weeds"], model_params["max_steps_sick"]))
 
         # TODO: Agents need to be created and added to the schedule here
         # Add the active agents (farming robots)
-        for i in range(self.active_agents):
+        self.activeAgents = list()
+        for i, pos in enumerate(self.layout.robotPositions(self.active_agents)):
             agent = ActiveAgent(self.next_id(), (0, i), self, **model_params)
-            self.grid.place_agent(agent, (48, 48-i))
+            self.grid.place_agent(agent, pos)
             self.schedule.add(agent)
+            self.activeAgents.append(agent)
+            if self.timer is not None:
+                for name in ("calculatePath", "update_perception", "calculatePriorityTool"):
+                    self.timer.wrap(agent, name)
 
         # Add the passive agents (land, crops)
-        for n in range(1, int(self.width/2) - 1):
-            for j in range(self.height-2):
-                agent = PassiveAgent(
-                    self.next_id(), (n*2 - 1, j+1), self, **model_params)
-                self.grid.place_agent(agent, (n*2 - 1, j+1))
-                self.knowledgeMap.update(PassiveAgentPerception(agent))
-                self.schedule.add(agent)
+        fieldPositions = [tuple(pos) for pos in self.layout.fieldPositions.tolist()]
+        self.knowledgeMap.allocateFields(fieldPositions)
+        # Optional common random numbers for the crop events (see ag_sim/events.py)
+        self.cropEvents = None
+        if model_params.get("crop_event_seed") is not None:
+            self.cropEvents = CropEventStream(model_params["crop_event_seed"], len(fieldPositions))
+        self.fieldAgents = PassiveAgent.createFields(self, fieldPositions, self.fieldAgents, **model_params)
+        for agent in self.fieldAgents:
+            self.grid.place_agent(agent, agent.pos)
+            self.knowledgeMap.update(PassiveAgentPerception(agent))
+            self.schedule.add(agent)
 
         # Add the farm agent
         agent = FarmAgent(self.next_id(), self.farmPos, self)
@@ -217,6 +431,14 @@ class AgSimulator(Model):
         self.grid.place_agent(agent, self.farmPos)
         self.schedule.add(agent)
 
+        # Optional central task allocation (see ag_sim/allocation.py)
+        self.allocator = None
+        if model_params.get("central_allocation", False) and model_params.get("com_protocol") in ("Helper-Based protocol", "Coordination Cooperative protocol"):
+            self.allocator = TaskAllocator(self, **model_params)
+
+        if self.timer is not None:
+            self.timer.wrap(self.schedule, "getPassiveAgentOnPos")
+
         self.running = True
         self.datacollector.collect(self)
 
@@ -225,8 +447,14 @@ class AgSimulator(Model):
     '''
 
     def step(self):
-        self.schedule.step()
-        self.datacollector.collect(self)
+        timer = self.timer or NO_TIMER
+        if self.allocator is not None:
+            with timer.measure("stage", "allocation"):
+                self.allocator.allocate()
+        with timer.measure("stage", "schedule"):
+            self.schedule.step()
+        with timer.measure("stage", "datacollector"):
+            self.datacollector.collect(self)
 
     # Functions for harvest score
 
@@ -260,12 +488,72 @@ class AgSimulator(Model):
     def get_total_steps_weeds(self, model):
         return model.total_steps_weeds
 
+    # Function for the timing measurements (only reported when the "timing" parameter is set)
+
+    def get_timing(self, model):
+        return model.timer.report()
+
     '''
-    *** run_model defines the end condition for simulation and overwrites Model.run_model
+    *** settled is True once nothing that is measured can change anymore: every field is harvested or dead (the
+        robots keep driving, but there is no field left for them to change)
+    *** extrapolate records the rows of the remaining steps until step_count without running them, with the
+        constant values of the settled model (the robots stay where they were), so the collected data has the same
+        shape as a full run
     '''
 
-    def run_model(self, step_count=4800):
-        for i in range(step_count):
-            if i % 100 == 0:
+    def settled(self):
+        return self.knowledgeMap.settled()
+
+    def extrapolate(self, step_count):
+        while self.schedule.steps < step_count:
+            self.schedule.steps += 1
+            self.schedule.time += 1
+            self.datacollector.collect(self)
+
+    '''
+    *** run_model runs the model until step step_count (a model resumed from a checkpoint continues where it was)
+        Optional:
+                - checkpoint_path: a checkpoint is written there every checkpoint_interval steps (see ag_sim/checkpoint.py)
+                - replay_path: a replay log of the run is written there, with a keyframe every replay_interval steps
+                  (see ag_sim/replay.py; view it with createReplayServer in ag_sim/server.py)
+                - verbose: print every 100th step, the step the run settled at and the timing summary (with the
+                  "timing" parameter); False runs silently (the command-line runner reports its own progress, see
+                  ag_sim/cli.py)
+    *** Returns the timing summary (see StageTimer.summary), None without the "timing" parameter
+    *** With the stop_when_settled model parameter, the run ends as soon as it is settled and the remaining steps are extrapolated
+    '''
+
+    def run_model(self, step_count=4800, checkpoint_path=None, checkpoint_interval=500, replay_path=None,
+                  replay_interval=100, verbose=True):
+        recorder = None
+        if replay_path is not None:
+            recorder = ReplayRecorder(self, replay_interval)
+            recorder.record(self)
+        for i in range(self.schedule.steps, step_count):
+            if verbose and i % 100 == 0:
                 print("Step " + str(i))
             self.step()
+            if recorder is not None:
+                recorder.record(self)
+            if checkpoint_path is not None and self.schedule.steps % checkpoint_interval == 0:
+                saveCheckpoint(self, checkpoint_path)
+            if self.stop_when_settled and self.settled():
+                if verbose:
+                    print("Settled at step " + str(self.schedule.steps))
+                self.extrapolate(step_count)
+                self.running = False
+                break
+        if recorder is not None:
+            recorder.save(replay_path)
+        if self.timer is None:
+            return None
+        summary = self.timer.summary()
+        if verbose:
+            print(summary)
+        return summary
+
+    # Create a model from a checkpoint written by run_model or checkpoint.saveCheckpoint
+    @staticmethod
+    def resume(checkpoint_path):
+        return loadCheckpoint(checkpoint_path)
+
@@ -0,0 +1,129 @@
+import os
+import numpy
+from mesa import Model
+
+'''
+*** ReplayRecorder records a compact log of a run, to be viewed later without simulating it again (ReplayModel)
+*** Per step it keeps:
+                - codes: the state code of every field followed by its perceived state code (AgentKnowledgeMap
+                  stateCodes and perceivedCodes), as the indices and new values of the codes that changed
+                - robots: the position of every ActiveAgent
+                - plan heads: the next cell of the plan of every ActiveAgent ((-1, -1) without a plan)
+*** Every keyframe_interval steps all codes are kept as well (keyframe), so a step is found by applying the changes
+*** of at most keyframe_interval steps to the keyframe before it
+*** The log is a single compressed .npz file; a typical run of 5000 steps takes well under a megabyte
+*** Steps are counted from the first recorded step (the start of the run, or the checkpoint it was resumed from)
+'''
+
+
+def modelCodes(model):
+    knowledge = model.knowledgeMap
+    return numpy.concatenate((knowledge.stateCodes, knowledge.perceivedCodes))
+
+
+def planHead(model, robot):
+    plans = model.knowledgeMap.planAgents.get(robot.unique_id)
+    return plans[0].pos if plans else (-1, -1)
+
+
+class ReplayRecorder():
+
+    def __init__(self, model, keyframe_interval=100):
+        self.keyframe_interval = keyframe_interval
+        self.width = model.width
+        self.height = model.height
+        self.farmPos = model.farmPos
+        self.fieldPositions = model.knowledgeMap.fieldPositions.copy()
+        self.last = None
+        self.keyframes = list()
+        self.indices = list()
+        self.values = list()
+        self.offsets = [0]
+        self.robots = list()
+        self.planHeads = list()
+
+    # Record the current step of model (call once after creating the model and after every step)
+    def record(self, model):
+        codes = modelCodes(model)
+        if len(self.robots) % self.keyframe_interval == 0:
+            self.keyframes.append(codes.copy())
+        if self.last is not None:
+            changed = numpy.flatnonzero(codes != self.last)
+            self.indices.append(changed.astype(numpy.int32))
+            self.values.append(codes[changed])
+            self.offsets.append(self.offsets[-1] + len(changed))
+        self.last = codes.copy()
+        self.robots.append([agent.pos for agent in model.activeAgents])
+        self.planHeads.append([planHead(model, agent) for agent in model.activeAgents])
+
+    def save(self, path):
+        temporary = path + ".tmp.npz"
+        numpy.savez_compressed(
+            temporary, size=numpy.array([self.width, self.height]), farm=numpy.array(self.farmPos),
+            fields=self.fieldPositions, keyframe_interval=numpy.array(self.keyframe_interval),
+            keyframes=numpy.array(self.keyframes, dtype=numpy.int8),
+            indices=numpy.concatenate(self.indices or [numpy.zeros(0, dtype=numpy.int32)]),
+            values=numpy.concatenate(self.values or [numpy.zeros(0, dtype=numpy.int8)]),
+            offsets=numpy.array(self.offsets, dtype=numpy.int64),
+            robots=numpy.array(self.robots, dtype=numpy.int16).reshape(len(self.robots), -1, 2),
+            plans=numpy.array(self.planHeads, dtype=numpy.int16).reshape(len(self.planHeads), -1, 2))
+        os.replace(temporary, path)
+
+
+'''
+*** ReplayModel plays a log of ReplayRecorder in the ModularServer (see createReplayServer in ag_sim/server.py)
+    Input:
+          - path of the log
+          - start_step: the step shown first (seeking to it costs at most keyframe_interval steps of changes)
+          - speed: number of recorded steps per model step
+*** The state of the current step is in stateCodes, perceivedCodes, robots and planHeads
+'''
+
+
+class ReplayModel(Model):
+
+    def __init__(self, path, start_step=0, speed=1):
+        super().__init__()
+        with numpy.load(path) as log:
+            self.log = {name: log[name] for name in log.files}
+        self.width, self.height = (int(value) for value in self.log["size"])
+        self.farmPos = tuple(int(value) for value in self.log["farm"])
+        self.fieldPositions = self.log["fields"]
+        self.steps = len(self.log["robots"]) - 1
+        self.speed = max(int(speed), 1)
+        self.seek(start_step)
+
+    def seek(self, step):
+        step = min(max(int(step), 0), self.steps)
+        interval = int(self.log["keyframe_interval"])
+        start = step - step % interval
+        self.codes = self.log["keyframes"][start // interval].copy()
+        self.step_to(start, step)
+
+    # Apply the changes of the steps after start up to step
+    def step_to(self, start, step):
+        offsets, indices, values = self.log["offsets"], self.log["indices"], self.log["values"]
+        for current in range(start, step):
+            changes = slice(offsets[current], offsets[current + 1])
+            self.codes[indices[changes]] = values[changes]
+        self.current = step
+        fields = len(self.fieldPositions)
+        self.stateCodes, self.perceivedCodes = self.codes[:fields], self.codes[fields:]
+        self.robots = self.log["robots"][step]
+        self.planHeads = self.log["plans"][step]
+        self.running = step < self.steps
+
+    def step(self):
+        self.step_to(self.current, min(self.current + self.speed, self.steps))
+
+
+# Number of recorded steps of a log, without loading it
+def replaySteps(path):
+    with numpy.load(path) as log:
+        return len(log["offsets"]) - 1
+
+
+# Grid size (width, height) of a log, without loading it
+def replaySize(path):
+    with numpy.load(path) as log:
+        return tuple(int(value) for value in log["size"])
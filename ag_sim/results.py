@@ -0,0 +1,180 @@
+import json
+import os
+import shutil
+import numpy
+from ag_sim.replay import ReplayRecorder
+
+'''
+*** ResultsStore streams the results of experiment runs to disk, so memory stays flat however many runs are done
+*** Layout of a store directory:
+                - manifest.jsonl: one line (JSON) per finished run, appended when the run is committed; a run that is
+                  written again under the same id is committed again, and its last line replaces the earlier ones
+                - <run id>/run.json: the same entry, written when the run is closed
+                - <run id>/<column>.<chunk>.npy: the values of a column, in chunks of chunk_size rows
+*** Chunks are plain .npy files, so readers can memory-map them (mmap_mode="r") without loading the whole run
+*** Runs without a manifest line (e.g. an interrupted run) are ignored by the readers and overwritten when the run is redone
+'''
+
+
+class RunWriter():
+
+    '''
+    *** Constructor:
+        Inputs:
+               - directory of the run
+               - names of the columns (the values passed to append are in this order)
+               - metadata of the run (parameters, seed, ...) stored in its manifest entry
+               - chunk_size: number of rows kept in memory before they are written
+    '''
+
+    def __init__(self, directory, run_id, columns, metadata=None, chunk_size=1000):
+        self.directory = directory
+        self.run_id = run_id
+        self.columns = tuple(columns)
+        self.metadata = metadata or {}
+        self.chunk_size = chunk_size
+        self.buffer = [list() for _ in self.columns]
+        self.rows = 0
+        self.chunks = 0
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+    def append(self, values):
+        for column, value in zip(self.buffer, values):
+            column.append(value)
+        self.rows += 1
+        if len(self.buffer[0]) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.buffer[0]) == 0:
+            return
+        for name, column in zip(self.columns, self.buffer):
+            numpy.save(os.path.join(self.directory, chunkName(
+                name, self.chunks)), numpy.asarray(column))
+            column.clear()
+        self.chunks += 1
+
+    # Write the remaining rows and run.json; returns the manifest entry of the run
+    def close(self):
+        self.flush()
+        entry = dict(self.metadata, run=self.run_id, columns=list(self.columns),
+                     rows=self.rows, chunks=self.chunks)
+        with open(os.path.join(self.directory, "run.json"), "w") as file:
+            json.dump(entry, file)
+        return entry
+
+
+def chunkName(column, chunk):
+    return "{}.{:05d}.npy".format(column, chunk)
+
+
+class ResultsStore():
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.manifestPath = os.path.join(path, "manifest.jsonl")
+
+    # Create a writer for a new run; run_id defaults to the next free "run-<number>"
+    def create_run(self, columns, metadata=None, run_id=None, chunk_size=1000):
+        if run_id is None:
+            number = len(self.manifest())
+            while os.path.exists(os.path.join(self.path, "run-{:05d}".format(number))):
+                number += 1
+            run_id = "run-{:05d}".format(number)
+        return RunWriter(os.path.join(self.path, run_id), run_id, columns, metadata, chunk_size)
+
+    # Add the entry of a closed run to the manifest
+    def commit(self, entry):
+        with open(self.manifestPath, "a") as file:
+            file.write(json.dumps(entry) + "\n")
+
+    '''
+    *** write_model streams a model run into the store: the model reporters of its datacollector are recorded
+        before the first step and after every step (steps + 1 rows, like the model's own datacollector)
+        Input:
+              - model (AgSimulator)
+              - number of steps to run
+              - metadata of the run (parameters, seed, ...)
+              - commit: add the run to the manifest (see ag_sim/sweep.py for runs committed by another process)
+              - stop_when_settled: stop simulating once the model is settled (AgSimulator.settled) and repeat its last
+                row for the remaining steps; the entry then has the step it settled at (None uses the
+                stop_when_settled model parameter, off by default)
+              - replay_interval: record a replay log of the run (replay.npz in its directory, see ag_sim/replay.py)
+                with a keyframe every replay_interval steps; None records no log
+              - progress: progress(step, steps) is called after every step (see ag_sim/cli.py)
+        Output:
+              - manifest entry of the run
+    '''
+
+    def write_model(self, model, steps, metadata=None, run_id=None, chunk_size=1000, columns=None, commit=True,
+                    stop_when_settled=None, replay_interval=None, progress=None):
+        reporters = model.datacollector.model_reporters
+        columns = columns or [name for name in reporters if name != "timing"]
+        if stop_when_settled is None:
+            stop_when_settled = model.stop_when_settled
+        writer = self.create_run(columns, metadata, run_id, chunk_size)
+        recorder = ReplayRecorder(model, replay_interval) if replay_interval else None
+        row = [reporters[name](model) for name in columns]
+        writer.append(row)
+        if recorder is not None:
+            recorder.record(model)
+        settled = None
+        for step in range(steps):
+            if settled is None:
+                model.step()
+                row = [reporters[name](model) for name in columns]
+                if stop_when_settled and model.settled():
+                    settled = model.schedule.steps
+            writer.append(row)
+            if recorder is not None:
+                recorder.record(model)
+            if progress is not None:
+                progress(step + 1, steps)
+        if settled is not None:
+            writer.metadata = dict(writer.metadata, settled=settled)
+        if recorder is not None:
+            recorder.save(os.path.join(writer.directory, "replay.npz"))
+            writer.metadata = dict(writer.metadata, replay="replay.npz")
+        entry = writer.close()
+        if commit:
+            self.commit(entry)
+        return entry
+
+    # Entries of all finished runs (the last entry of every run id, in the order the runs were first committed)
+    def manifest(self):
+        if not os.path.exists(self.manifestPath):
+            return list()
+        entries = {}
+        with open(self.manifestPath) as file:
+            for line in file:
+                if line.strip():
+                    entry = json.loads(line)
+                    entries[entry["run"]] = entry
+        return list(entries.values())
+
+    def entry(self, run_id):
+        for entry in self.manifest():
+            if entry["run"] == run_id:
+                return entry
+        raise KeyError(run_id)
+
+    # Memory-mapped chunks of a column of a run
+    def chunks(self, run_id, column):
+        entry = self.entry(run_id)
+        return [numpy.load(os.path.join(self.path, run_id, chunkName(column, chunk)), mmap_mode="r")
+                for chunk in range(entry["chunks"])]
+
+    # A column of a run as one array (only this column is loaded)
+    def column(self, run_id, column):
+        chunks = self.chunks(run_id, column)
+        if len(chunks) == 0:
+            return numpy.zeros(0)
+        return numpy.concatenate(chunks)
+
+    def dataframe(self, run_id):
+        import pandas as pd
+
+        entry = self.entry(run_id)
+        return pd.DataFrame({name: self.column(run_id, name) for name in entry["columns"]})
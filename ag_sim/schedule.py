@@ -1,6 +1,6 @@
-from collections import defaultdict
 from mesa.time import *
 from ag_sim.agents import ActiveAgent, ActiveAgentPlanning
+from ag_sim.timing import NO_TIMER
 
 
 class ActivePassiveAgentActivation(SimultaneousActivation):
@@ -32,10 +32,34 @@ class ActivePassiveAgentActivation(SimultaneousActivation):
         else:
             del self._agents[agent.unique_id]
 
+    '''
+    *** step runs the step stage and then the advance stage for all agents (see SimultaneousActivation)
+    *** When the model has a StageTimer, every stage is timed per agent class (StageTimer.callAgents); without one,
+        NO_TIMER calls the agents without timing them
+    '''
+
+    def step(self):
+        timer = self.model.timer or NO_TIMER
+        agent_keys = list(self._agents.keys())
+        for stage in ("step", "advance"):
+            with timer.measure("stage", "schedule." + stage):
+                timer.callAgents((self._agents[agent_key] for agent_key in agent_keys), stage)
+        self.steps += 1
+        self.time += 1
+
     def getPassiveAgent(self, id):
         return self._agents[id]
 
+    # The first agent of the schedule at pos: the ActiveAgents were added first, then the fields and the farm
+    # Looked up by position (AgentKnowledgeMap.fieldIndexAt), so the cost does not grow with the size of the farm
     def getPassiveAgentOnPos(self, pos):
-        for each in self._agents:
-            if self._agents[each].pos == pos:
-                return self._agents[each]
+        model = self.model
+        for agent in model.activeAgents:
+            if agent.pos == pos:
+                return agent
+        knowledge = model.knowledgeMap
+        index = knowledge.fieldIndexAt.get(pos)
+        if index is not None:
+            return knowledge.fieldAgents[index]
+        if model.farmObject.pos == pos:
+            return model.farmObject
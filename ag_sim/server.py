@@ -1,9 +1,16 @@
-from mesa.visualization.ModularVisualization import ModularServer
-from mesa.visualization.modules import CanvasGrid, ChartModule, TextElement
+from mesa.visualization.ModularVisualization import ModularServer, VisualizationElement
+from mesa.visualization.modules import CanvasGrid, TextElement
 from mesa.visualization.UserParam import UserSettableParameter
-from collections import defaultdict
+from collections import Counter, defaultdict
+import base64
+import json
+import numpy
 from ag_sim.model import AgSimulator
-from ag_sim.agents import PassiveAgent, ActiveAgent, PassiveAgentPerception, ActiveAgentPlanning, PassiveAgentStateMachine, FarmAgent
+from ag_sim.agents import PassiveAgent, ActiveAgent, PassiveAgentPerception, ActiveAgentPlanning, FarmAgent
+from ag_sim.states import STATE_NAMES, STATE_CODES, DRY_STATES, WEEDS_STATES, SICK_STATES
+from ag_sim.liveserver import BackgroundServer
+from ag_sim.replay import ReplayModel, replaySteps, replaySize
+from ag_sim.charts import liveCharts
 
 
 '''
@@ -11,15 +18,38 @@ from ag_sim.agents import PassiveAgent, ActiveAgent, PassiveAgentPerception, Act
 *** It visualizes the Model.grid as well as the knowledgeMap of Agents
 *** CanvasGrid.render is overriden to loop through more grids, nothing else
 *** Refer to CanvasGrid
+*** With delta=True, render only sends the cells that changed since the last frame (drawn by ag_sim/js/DeltaCanvasModule.js):
+                - changed crops and perceptions are found by comparing the state code arrays of the knowledgeMap with
+                  the last frame, robots and plans by comparing their cells with the last frame
+                - every keyframe_interval frames, and for a new model, all cells are sent (keyframe)
+    The last frame is kept in the element, so a delta grid is meant for one browser at a time
 '''
 
 
 class AgSimGrid(CanvasGrid):
-    def __init__(self, portrayal_method, grid_width, grid_height, canvas_width=500, canvas_height=500):
+    def __init__(self, portrayal_method, grid_width, grid_height, canvas_width=500, canvas_height=500,
+                 delta=False, keyframe_interval=50):
         super().__init__(portrayal_method, grid_width,
                          grid_height*2, canvas_width, canvas_height*2)
+        self.delta = delta
+        self.keyframe_interval = keyframe_interval
+        if delta:
+            self.local_includes = ["ag_sim/js/DeltaCanvasModule.js"]
+            self.js_code = "elements.push(new DeltaCanvasModule({}, {}, {}, {}));".format(
+                self.canvas_width, self.canvas_height, self.grid_width, self.grid_height)
+
+        # Last frame: model, state codes of the fields, cells of the robots and steps left of the plans per cell
+        self.model = None
+        self.frames = 0
+        self.fieldCodes = None
+        self.perceivedCodes = None
+        self.robotCells = Counter()
+        self.planCells = {}
 
     def render(self, model):
+        if self.delta:
+            return self.renderDelta(model)
+
         grid_state = defaultdict(list)
         # Display simulation map
         for x in range(model.grid.width):
@@ -65,104 +95,261 @@ class AgSimGrid(CanvasGrid):
 
         return grid_state
 
+    # Portrayals of a cell of the canvas, assembled from the portrayal templates (see below) and the field arrays:
+    # the knowledgeMap in rows 0 to height - 1 (drawn in the lower half, as drawLayer turns y upside down), the simulation
+    # map in the rows above (drawn in the upper half)
+    def cellPortrayals(self, model, x, y, robotCells, planCells):
+        knowledge = model.knowledgeMap
+        height = model.grid.height
+        portrayals = list()
+        if y < height:
+            index = knowledge.fieldIndexAt.get((x, y))
+            if index is not None:
+                portrayals.append(portrayalAt(
+                    PERCEPTION_TEMPLATES[knowledge.perceivedCodes[index]], x, y))
+            elif (x, y) == model.farmPos:
+                portrayals.append(portrayalAt(FARM_TEMPLATE, x, y))
+            if (x, y) in planCells:
+                for plan in knowledge.planGrid.get_cell_list_contents([(x, y)]):
+                    portrayals.append(portrayalAt(
+                        planTemplate(plan.steps_left), x, y))
+        else:
+            pos = (x, y - height)
+            index = knowledge.fieldIndexAt.get(pos)
+            if index is not None:
+                portrayals.append(portrayalAt(
+                    CROP_TEMPLATES[knowledge.stateCodes[index]], x, y))
+            elif pos == model.farmPos:
+                portrayals.append(portrayalAt(FARM_TEMPLATE, x, y))
+            for _ in range(robotCells[pos]):
+                portrayals.append(portrayalAt(ROBOT_TEMPLATE, x, y))
+            if not portrayals:
+                portrayals.append(portrayalAt(ROAD_TEMPLATE, x, y))
+        return portrayals
+
+    def renderDelta(self, model):
+        knowledge = model.knowledgeMap
+        height = model.grid.height
+        robotCells = Counter(agent.pos for agent in model.activeAgents)
+        planCells = defaultdict(list)
+        for plans in knowledge.planAgents.values():
+            for plan in plans:
+                planCells[plan.pos].append(plan.steps_left)
+
+        keyframe = model is not self.model or self.frames % self.keyframe_interval == 0
+        if keyframe:
+            cells = [(x, y) for x in range(model.grid.width)
+                     for y in range(2 * height)]
+        else:
+            changed = set()
+            for index in numpy.flatnonzero(knowledge.stateCodes != self.fieldCodes):
+                x, y = knowledge.fieldPositions[index]
+                changed.add((x, y + height))
+            for index in numpy.flatnonzero(knowledge.perceivedCodes != self.perceivedCodes):
+                x, y = knowledge.fieldPositions[index]
+                changed.add((x, y))
+            for x, y in set(robotCells) | set(self.robotCells):
+                if robotCells[(x, y)] != self.robotCells[(x, y)]:
+                    changed.add((x, y + height))
+            for pos in set(planCells) | set(self.planCells):
+                if planCells.get(pos) != self.planCells.get(pos):
+                    changed.add(pos)
+            cells = sorted((int(x), int(y)) for x, y in changed)
+
+        self.model = model
+        self.frames = 1 if keyframe else self.frames + 1
+        self.fieldCodes = knowledge.stateCodes.copy()
+        self.perceivedCodes = knowledge.perceivedCodes.copy()
+        self.robotCells = robotCells
+        self.planCells = dict(planCells)
+        return {"keyframe": keyframe, "cells": [[x, y, self.cellPortrayals(model, x, y, robotCells, planCells)]
+                                                for x, y in cells]}
+
+'''
+*** Portrayal templates: the portrayals of every kind of cell are built once, as dicts indexed by state code
+*** (crops and perceptions) or by steps left (plans, 6 and more share a color); a portrayal is a copy of its template
+*** with x and y added, and the Color lists are shared by all copies
+'''
+
+# Tints for sick and weeds states
+SICK_TINT = "#0043fc"  # Blue
+WEEDS_TINT = "#ff00f2"  # Pink
+DEHYDRATED_TINT = "#49007a"  # Purple
+
+CROP_COLORS = {
+    # Start state colors
+    # light brown
+    "start": ['#8f713c', '#8f713c', '#8f713c'],
+    # Plowed state colors
+    # dark brown
+    "plowed": ['#734b10', '#734b10', '#734b10'],
+    # Seed state colors
+    # light green
+    "seed": ["#84e184", "#adebad", "#d6f5d6"],
+    "seed_sick": ["#84e184", "#adebad", SICK_TINT],
+    "seed_weeds": ["#84e184", "#adebad", WEEDS_TINT],
+    "seed_dry": ["#84e184", "#adebad", DEHYDRATED_TINT],
+    # Growing state colors
+    # dark green
+    "growing": ["#00FF00", "#00CC00", "#009900"],
+    "growing_sick": ["#00FF00", "#00CC00", SICK_TINT],
+    "growing_weeds": ["#00FF00", "#00CC00", WEEDS_TINT],
+    "growing_dry": ["#00FF00", "#00CC00", DEHYDRATED_TINT],
+    # Flowering state colors
+    # yellow
+    "flowering": ['#fffd73', '#faf743', '#f7f416'],
+    "flowering_sick": ['#fffd73', '#faf743', SICK_TINT],
+    "flowering_weeds": ['#fffd73', '#faf743', WEEDS_TINT],
+    "flowering_dry": ['#fffd73', '#faf743', DEHYDRATED_TINT],
+    # Harvestable state colors
+    # Orange
+    "harvestable": ['#ffd06b', '#ffc240', '#ffb10a'],
+    "harvestable_sick": ['#ffd06b', '#ffc240', SICK_TINT],
+    "harvestable_weeds": ['#ffd06b', '#ffc240', WEEDS_TINT],
+    "harvestable_dry": ['#ffd06b', '#ffc240', DEHYDRATED_TINT],
+    # End state colors
+    "dead": ['#000000', '#000000', '#000000'],
+    "harvested": ['#FFFFFF', '#FFFFFF', '#FFFFFF'],
+}
+
+# The knowledge map shows fewer colors; the other states are teal
+PERCEPTION_COLORS = {
+    "start": ['#abb6c6', '#abb6c6', '#abb6c6'],
+    "plowed": ['#734b10', '#734b10', '#734b10'],
+    "seed": ["#84e184", "#adebad", "#d6f5d6"],
+    "growing": ["#00FF00", "#00CC00", "#009900"],
+    "flowering": ['#ffd700', '#ffd700', '#ffd700'],
+    "dead": ['#abb6c6', '#abb6c6', '#abb6c6'],
+}
+
+PLAN_COLORS = [['#97649e', '#97649e', '#97649e'], ['#aa68af', '#aa68af', '#aa68af'], ["#bd6dc1", "#bd6dc1", "#bd6dc1"],
+               ["#cf72d2", "#cf72d2", "#cf72d2"], ['#e276e4', '#e276e4', '#e276e4'], ['#f57bf5', '#f57bf5', '#f57bf5'],
+               ['#ea317b', '#ea317b', '#ea317b']]
+
+
+def rectTemplate(color):
+    return {"Color": color, "Shape": "rect", "Filled": "true", "Layer": 1, "w": 1, "h": 1}
+
+
+ROAD_TEMPLATE = rectTemplate(["#d4ccbe", "#d4ccbe", "#d4ccbe"])
+FARM_TEMPLATE = rectTemplate(["#8a0000", "#8a0000", "#8a0000"])
+ROBOT_TEMPLATE = {"Color": ["#FF3300", "#FF3300", "#FF3300"], "Shape": "circle", "Filled": "true", "Layer": 1, "r": 1}
+CROP_TEMPLATES = [rectTemplate(CROP_COLORS[name]) for name in STATE_NAMES]
+PERCEPTION_TEMPLATES = [rectTemplate(PERCEPTION_COLORS.get(name, ['#008080', '#008080', '#008080']))
+                        for name in STATE_NAMES]
+PLAN_TEMPLATES = [rectTemplate(color) for color in PLAN_COLORS]
+
+
+def planBucket(steps_left):
+    return steps_left if 0 <= steps_left < len(PLAN_TEMPLATES) else len(PLAN_TEMPLATES) - 1
+
+
+def planTemplate(steps_left):
+    return PLAN_TEMPLATES[planBucket(steps_left)]
+
+
+def portrayalAt(template, x, y):
+    portrayal = dict(template)
+    portrayal["x"] = x
+    portrayal["y"] = y
+    return portrayal
+
+
 # How colors for the agents are determined
 
 
 def ag_sim_portrayal(agent):
-    portrayal = {}
     if agent is None:
-        portrayal["Color"] = ["#d4ccbe", "#d4ccbe", "#d4ccbe"]
-        portrayal["Shape"] = "rect"
-        portrayal["Filled"] = "true"
-        portrayal["Layer"] = 1
-        portrayal["w"] = 1
-        portrayal["h"] = 1
+        return dict(ROAD_TEMPLATE)
     elif type(agent) is FarmAgent:
-        portrayal["Color"] = ["#8a0000", "#8a0000", "#8a0000"]
-        portrayal["Shape"] = "rect"
-        portrayal["Filled"] = "true"
-        portrayal["Layer"] = 1
-        portrayal["w"] = 1
-        portrayal["h"] = 1
+        return dict(FARM_TEMPLATE)
     elif type(agent) is PassiveAgent:
-        # Tints for sick and weeds states
-        sick_tint = "#0043fc"  # Blue
-        weeds_tint = "#ff00f2"  # Pink
-        dehydrated_tint = "#49007a"  # Purple
-
-        switcher = {
-            # Start state colors
-            # light brown
-            PassiveAgentStateMachine.start: ['#8f713c', '#8f713c', '#8f713c'],
-            # Plowed state colors
-            # dark brown
-            PassiveAgentStateMachine.plowed: ['#734b10', '#734b10', '#734b10'],
-            # Seed state colors
-            # light green
-            PassiveAgentStateMachine.seed: ["#84e184", "#adebad", "#d6f5d6"],
-            PassiveAgentStateMachine.seed_sick: ["#84e184", "#adebad", sick_tint],
-            PassiveAgentStateMachine.seed_weeds: ["#84e184", "#adebad", weeds_tint],
-            PassiveAgentStateMachine.seed_dry: ["#84e184", "#adebad", dehydrated_tint],
-            # Growing state colors
-            # dark green
-            PassiveAgentStateMachine.growing: ["#00FF00", "#00CC00", "#009900"],
-            PassiveAgentStateMachine.growing_sick: ["#00FF00", "#00CC00", sick_tint],
-            PassiveAgentStateMachine.growing_weeds: ["#00FF00", "#00CC00", weeds_tint],
-            PassiveAgentStateMachine.growing_dry: ["#00FF00", "#00CC00", dehydrated_tint],
-            # Flowering state colors
-            # yellow
-            PassiveAgentStateMachine.flowering: ['#fffd73', '#faf743', '#f7f416'],
-            PassiveAgentStateMachine.flowering_sick: ['#fffd73', '#faf743', sick_tint],
-            PassiveAgentStateMachine.flowering_weeds: ['#fffd73', '#faf743', weeds_tint],
-            PassiveAgentStateMachine.flowering_dry: ['#fffd73', '#faf743', dehydrated_tint],
-
-            # Harvestable state colors
-            # Orange
-            PassiveAgentStateMachine.harvestable: ['#ffd06b', '#ffc240', '#ffb10a'],
-            PassiveAgentStateMachine.harvestable_sick: ['#ffd06b', '#ffc240', sick_tint],
-            PassiveAgentStateMachine.harvestable_weeds: ['#ffd06b', '#ffc240', weeds_tint],
-            PassiveAgentStateMachine.harvestable_dry: ['#ffd06b', '#ffc240', dehydrated_tint],
-            # End state colors
-            PassiveAgentStateMachine.dead: ['#000000', '#000000', '#000000'],
-            PassiveAgentStateMachine.harvested: [
-                '#FFFFFF', '#FFFFFF', '#FFFFFF']
-        }
-        color = switcher.get(agent.machine.current_state,  [
-                             '#abb6c6', '#abb6c6', '#abb6c6'])
-        portrayal["Color"] = color
-        portrayal["Shape"] = "rect"
-        portrayal["Filled"] = "true"
-        portrayal["Layer"] = 1
-        portrayal["w"] = 1
-        portrayal["h"] = 1
+        return dict(CROP_TEMPLATES[STATE_CODES[agent.machine.current_state.value]])
     elif type(agent) is ActiveAgent:
-        portrayal["Color"] = ["#FF3300", "#FF3300", "#FF3300"]
-        portrayal["Shape"] = "circle"
-        portrayal["Filled"] = "true"
-        portrayal["Layer"] = 1
-        portrayal["r"] = 1
+        return dict(ROBOT_TEMPLATE)
     elif type(agent) is ActiveAgentPlanning:
-        switcher = {0: ['#97649e', '#97649e', '#97649e'], 1: ['#aa68af', '#aa68af', '#aa68af'], 2: ["#bd6dc1", "#bd6dc1", "#bd6dc1"], 3: [
-            "#cf72d2", "#cf72d2", "#cf72d2"], 4: ['#e276e4', '#e276e4', '#e276e4'], 5: ['#f57bf5', '#f57bf5', '#f57bf5'], 6: ['#ea317b', '#ea317b', '#ea317b']}
-        color = switcher.get(agent.steps_left,   [
-                             '#ea317b', '#ea317b', '#ea317b'])
-        portrayal["Color"] = color
-        portrayal["Shape"] = "rect"
-        portrayal["Filled"] = "true"
-        portrayal["Layer"] = 1
-        portrayal["w"] = 1
-        portrayal["h"] = 1
+        return dict(planTemplate(agent.steps_left))
     elif type(agent) is PassiveAgentPerception:
-        switcher = {PassiveAgentStateMachine.start: ['#abb6c6', '#abb6c6', '#abb6c6'], PassiveAgentStateMachine.plowed: ['#734b10', '#734b10', '#734b10'], PassiveAgentStateMachine.seed: ["#84e184", "#adebad", "#d6f5d6"], PassiveAgentStateMachine.growing: [
-            "#00FF00", "#00CC00", "#009900"], PassiveAgentStateMachine.flowering: ['#ffd700', '#ffd700', '#ffd700'], PassiveAgentStateMachine.harvest: ['#f5821f', '#f5821f', '#f5821f'], PassiveAgentStateMachine.dead: ['#abb6c6', '#abb6c6', '#abb6c6']}
-        color = switcher.get(agent.state,   ['#008080', '#008080', '#008080'])
-        portrayal["Color"] = color
-        portrayal["Shape"] = "rect"
-        portrayal["Filled"] = "true"
-        portrayal["Layer"] = 1
-        portrayal["w"] = 1
-        portrayal["h"] = 1
-    return portrayal
+        return dict(PERCEPTION_TEMPLATES[STATE_CODES[agent.state.value]])
+    return {}
+
+'''
+*** AgSimCodeGrid is a compact alternative to AgSimGrid: every frame is sent as uint8 code grids instead of portrayals
+                - field: the simulation map (road, farm or crop state per cell)
+                - knowledge: the knowledge map of the ActiveAgents (farm or perceived crop state per cell)
+                - plans: the plans on the knowledge map (steps left, 0 where there is no plan)
+                - robots: the positions of the ActiveAgents, as a flat list x0, y0, x1, y1, ...
+*** The grids are base64 encoded (row y, column x) inside the JSON message of the ModularServer
+*** The browser (ag_sim/js/CodeGridModule.js) draws them with PALETTE, which is sent once with the element: one color per
+*** code, taken from the portrayals (the tint for sick, weeds and dehydrated crops, as in the legend)
+*** A frame of the 50x50 map is about 10 KB, whatever happens on it, so much larger maps can be shown as well
+'''
+
+# Codes of the grids: EMPTY is not drawn, the other codes index PALETTE
+EMPTY, ROAD, FARM = 0, 1, 2
+CROP_CODE = 3
+PERCEPTION_CODE = CROP_CODE + len(STATE_NAMES)
+PLAN_CODE = PERCEPTION_CODE + len(STATE_NAMES)
+
+PALETTE = (["#FFFFFF", ROAD_TEMPLATE["Color"][0], FARM_TEMPLATE["Color"][0]] +
+           [CROP_COLORS[name][2] if name in DRY_STATES + WEEDS_STATES + SICK_STATES else CROP_COLORS[name][1]
+            for name in STATE_NAMES] +
+           [template["Color"][1] for template in PERCEPTION_TEMPLATES] +
+           [template["Color"][0] for template in PLAN_TEMPLATES] +
+           [ROBOT_TEMPLATE["Color"][0]])
+
+
+class AgSimCodeGrid(VisualizationElement):
+    local_includes = ["ag_sim/js/CodeGridModule.js"]
+
+    def __init__(self, grid_width, grid_height, canvas_width=500, canvas_height=500):
+        self.grid_width = grid_width
+        self.grid_height = grid_height
+        self.js_code = "elements.push(new CodeGridModule({}, {}, {}, {}, {}));".format(
+            canvas_width, canvas_height * 2, grid_width, grid_height, json.dumps(PALETTE))
+
+    @staticmethod
+    def encode(grid):
+        return base64.b64encode(grid.tobytes()).decode()
+
+    # Frame of the given state: plan cells as (x, y, steps left), robot positions as (x, y)
+    def frame(self, width, height, farmPos, fieldPositions, stateCodes, perceivedCodes, planCells, robotCells):
+        x, y = fieldPositions.T
+        field = numpy.full((height, width), ROAD, dtype=numpy.uint8)
+        field[y, x] = CROP_CODE + stateCodes
+        field[farmPos[1], farmPos[0]] = FARM
+
+        perceived = numpy.full_like(field, EMPTY)
+        perceived[y, x] = PERCEPTION_CODE + perceivedCodes
+        perceived[farmPos[1], farmPos[0]] = FARM
+
+        plans = numpy.full_like(field, EMPTY)
+        for plan_x, plan_y, steps_left in planCells:
+            plans[plan_y, plan_x] = PLAN_CODE + planBucket(steps_left)
+
+        robots = [int(value) for pos in robotCells for value in pos]
+        return {"field": self.encode(field), "knowledge": self.encode(perceived), "plans": self.encode(plans),
+                "robots": robots}
+
+    def render(self, model):
+        knowledge = model.knowledgeMap
+        # The last plan placed on a cell is the one drawn on top
+        cells = {plan.pos for agents in knowledge.planAgents.values() for plan in agents}
+        planCells = [cell + (knowledge.planGrid.get_cell_list_contents([cell])[-1].steps_left,) for cell in cells]
+        return self.frame(model.grid.width, model.grid.height, model.farmPos, knowledge.fieldPositions,
+                          knowledge.stateCodes, knowledge.perceivedCodes, planCells,
+                          [agent.pos for agent in model.activeAgents])
+
+
+# AgSimCodeGrid for a ReplayModel (ag_sim/replay.py): the plan heads are drawn as plans with 0 steps left
+
+
+class ReplayCodeGrid(AgSimCodeGrid):
+    def render(self, model):
+        planCells = [(x, y, 0) for x, y in model.planHeads if x >= 0]
+        return self.frame(model.width, model.height, model.farmPos, model.fieldPositions, model.stateCodes,
+                          model.perceivedCodes, planCells, model.robots)
+
 
 # Class for representing the legend
 
@@ -201,8 +388,6 @@ class ag_sim_legend(TextElement):
         return css + "<div style='background-color:whitesmoke;padding:5px;'" + title + "<ul style='position:relative; left:-80px;'>" + all_legend_rows + "</ul></div>"
 
 
-canvas = AgSimGrid(ag_sim_portrayal, 50, 50, 500, 500)
-
 # Create the legend
 legend = ag_sim_legend()
 
@@ -212,6 +397,7 @@ model_params = {
     "static_text": UserSettableParameter('static_text', value="<b>About</b><br>Shown below are all settable agent parameters. The legend shown on the right pertains only to the first map, which shows the position and states of all agents. The second map represents the knowledgemap of the active agents. "),
     "active_agents": UserSettableParameter("slider", "Number of active agents", 6, 6, 30),
     "com_protocol": UserSettableParameter("choice", "Communication protocol", value="Helper-Based protocol", choices=["Simple protocol", "Helper-Based protocol", "Coordination Cooperative protocol"]),
+    "central_allocation": UserSettableParameter("checkbox", "Central task allocation (Helper-Based and Coordination protocols)", value=False),
 
     # Water, sick, and weeds states
     "max_water_level": UserSettableParameter("number", "A crops maximum water level (in steps)", 750, 1, 100000),
@@ -236,6 +422,48 @@ model_params = {
     "steps_harvestable_to_dead": UserSettableParameter("number", "Maximum number of steps that a crop can be in the harvestable state before dying", 500, 1, 100000),
 }
 
-server = ModularServer(
-    AgSimulator, [legend, canvas], "Agriculture Simulation", model_params)
-server.port = 8521
+
+# Create the server; with binary=True the maps are sent as code grids (AgSimCodeGrid) instead of portrayals,
+# with delta=True the canvas only sends the cells that changed since the last frame (AgSimGrid),
+# with background=True the model runs in a background thread and the browser samples its frames (ag_sim/liveserver.py)
+# The charts below the maps are downsampled to at most chart_buckets points per series (ag_sim/charts.py)
+# width, height and layout (arguments of layout.generateLayout) set the farm of the model; the maps are 500 pixels wide
+# (use binary=True for large farms, the portrayals of every cell are too much for the browser)
+
+
+def createServer(binary=False, background=False, frame_every=None, chart_buckets=500, width=50, height=50,
+                 layout=None, delta=False):
+    canvas_height = 500 * height // width
+    if binary:
+        grid = AgSimCodeGrid(width, height, 500, canvas_height)
+    else:
+        grid = AgSimGrid(ag_sim_portrayal, width, height, 500, canvas_height, delta=delta)
+    elements = [legend, grid] + liveCharts(chart_buckets)
+    params = dict(model_params, width=width, height=height, layout=layout)
+    if background:
+        server = BackgroundServer(AgSimulator, elements, "Agriculture Simulation", params,
+                                  frame_every=frame_every)
+    else:
+        server = ModularServer(
+            AgSimulator, elements, "Agriculture Simulation", params)
+    server.port = 8521
+    return server
+
+
+# Create a server that plays a log of ReplayRecorder (ag_sim/replay.py); seek by moving the step slider and resetting
+
+
+def createReplayServer(path):
+    replay_params = {
+        "path": path,
+        "start_step": UserSettableParameter("slider", "Step", 0, 0, replaySteps(path), 1),
+        "speed": UserSettableParameter("slider", "Steps per frame", 1, 1, 100, 1),
+    }
+    width, height = replaySize(path)
+    server = ModularServer(ReplayModel, [legend, ReplayCodeGrid(width, height, 500, 500 * height // width)],
+                           "Agriculture Simulation Replay", replay_params)
+    server.port = 8521
+    return server
+
+
+server = createServer()
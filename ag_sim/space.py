@@ -0,0 +1,109 @@
+import itertools
+import random
+from mesa.space import Grid, accept_tuple_argument
+
+'''
+*** Sparse versions of the mesa SingleGrid and MultiGrid: only the occupied cells are stored, in a dictionary keyed by
+*** position, so an empty cell costs nothing and a grid of 10^6 cells is created instantly
+*** They keep the interface of the mesa grids (place_agent, move_agent, remove_agent, get_cell_list_contents,
+*** is_cell_empty, grid[x][y], move_to_empty, find_empty and the neighborhoods, which are inherited from
+*** mesa.space.Grid)
+*** Iterating a sparse grid gives the contents of the occupied cells only, in x-major order like a mesa grid
+*** There is no list of empty cells: move_to_empty and find_empty draw random positions until they hit an empty one
+*** (or pick from all empty cells once most of the grid is occupied)
+*** A cell of a SparseMultiGrid is a list in the order the agents were placed, so the last agent placed is last
+'''
+
+
+# One column of a sparse grid, so grid[x][y] works as for a mesa grid
+class SparseColumn():
+
+    def __init__(self, grid, x):
+        self.grid = grid
+        self.x = x
+
+    def __getitem__(self, y):
+        return self.grid.cells.get((self.x, y), self.grid.default_val())
+
+
+class SparseGrid(Grid):
+
+    def __init__(self, width, height, torus=False):
+        self.width = width
+        self.height = height
+        self.torus = torus
+        self.cells = {}
+
+    def __getitem__(self, x):
+        return SparseColumn(self, x)
+
+    def __iter__(self):
+        return (self.cells[pos] for pos in sorted(self.cells))
+
+    def coord_iter(self):
+        return ((self.cells[pos], pos[0], pos[1]) for pos in sorted(self.cells))
+
+    def _place_agent(self, pos, agent):
+        if pos in self.cells:
+            raise Exception("Cell not empty")
+        self.cells[pos] = agent
+
+    def _remove_agent(self, pos, agent):
+        del self.cells[pos]
+
+    def is_cell_empty(self, pos):
+        return pos not in self.cells
+
+    @accept_tuple_argument
+    def iter_cell_list_contents(self, cell_list):
+        cells = self.cells
+        return (cells[pos] for pos in map(tuple, cell_list) if pos in cells)
+
+    def exists_empty_cells(self):
+        return len(self.cells) < self.width * self.height
+
+    # A random empty position drawn with rng, None if the grid is full
+    def randomEmpty(self, rng):
+        if not self.exists_empty_cells():
+            return None
+        if 2 * len(self.cells) > self.width * self.height:
+            return rng.choice([pos for pos in itertools.product(range(self.width), range(self.height))
+                               if pos not in self.cells])
+        while True:
+            pos = (rng.randrange(self.width), rng.randrange(self.height))
+            if pos not in self.cells:
+                return pos
+
+    def move_to_empty(self, agent):
+        pos = self.randomEmpty(agent.random)
+        if pos is None:
+            raise Exception("ERROR: No empty cells")
+        self.move_agent(agent, pos)
+
+    # Like mesa's find_empty, with the global random generator
+    def find_empty(self):
+        return self.randomEmpty(random)
+
+
+class SparseMultiGrid(SparseGrid):
+
+    @staticmethod
+    def default_val():
+        return []
+
+    def _place_agent(self, pos, agent):
+        cell = self.cells.get(pos)
+        if cell is None:
+            cell = self.cells[pos] = []
+        cell.append(agent)
+
+    def _remove_agent(self, pos, agent):
+        cell = self.cells[pos]
+        cell.remove(agent)
+        if not cell:
+            del self.cells[pos]
+
+    @accept_tuple_argument
+    def iter_cell_list_contents(self, cell_list):
+        cells = self.cells
+        return (agent for pos in map(tuple, cell_list) if pos in cells for agent in cells[pos])
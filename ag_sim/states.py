@@ -0,0 +1,49 @@
+import numpy
+
+'''
+*** Integer codes for the states of PassiveAgentStateMachine and for the tools of the ActiveAgents
+*** Used wherever the fields are kept in numpy arrays (AgentKnowledgeMap, ag_sim/targeting.py)
+'''
+
+STATE_NAMES = ("start", "plowed",
+               "seed", "seed_sick", "seed_weeds", "seed_dry",
+               "growing", "growing_sick", "growing_weeds", "growing_dry",
+               "flowering", "flowering_sick", "flowering_weeds", "flowering_dry",
+               "harvestable", "harvestable_sick", "harvestable_weeds", "harvestable_dry",
+               "harvested", "dead")
+STATE_CODES = {name: code for code, name in enumerate(STATE_NAMES)}
+
+# State groups
+DRY_STATES = ("seed_dry", "growing_dry", "flowering_dry", "harvestable_dry")
+WEEDS_STATES = ("seed_weeds", "growing_weeds",
+                "flowering_weeds", "harvestable_weeds")
+SICK_STATES = ("seed_sick", "growing_sick",
+               "flowering_sick", "harvestable_sick")
+# Absorbing states: a field never leaves them
+TERMINAL_STATES = ("harvested", "dead")
+
+# Tools in the order used by FarmAgent and ActiveAgent.calculatePriorityTool
+TOOLS = ("plow", "seeder", "irrigator", "wacker", "sprayer", "harvester")
+TOOL_IDS = {tool: index for index, tool in enumerate(TOOLS)}
+
+# The states each tool can attend (see ActiveAgent.toolVSfield)
+TOOL_STATES = {
+    "plow": ("start",),
+    "seeder": ("plowed",),
+    "irrigator": DRY_STATES,
+    "wacker": WEEDS_STATES,
+    "sprayer": SICK_STATES,
+    "harvester": ("harvestable",),
+}
+
+
+# Boolean array over the state codes, True for the given states
+def stateMask(states):
+    mask = numpy.zeros(len(STATE_NAMES), dtype=bool)
+    mask[[STATE_CODES[state] for state in states]] = True
+    return mask
+
+
+TOOL_MASKS = {tool: stateMask(states) for tool, states in TOOL_STATES.items()}
+NO_TOOL_MASK = stateMask(())
+TERMINAL_MASK = stateMask(TERMINAL_STATES)
@@ -0,0 +1,270 @@
+import itertools
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from statistics import NormalDist
+import numpy
+from ag_sim.cache import ResultCache, configKey
+from ag_sim.results import ResultsStore
+
+'''
+*** Parameter sweeps over a process pool
+*** Every (parameter set, replicate) pair is a job; its seed is derived from the base seed, the parameter set index
+*** and the replicate, so a job gives the same result whichever worker runs it and in whichever order
+*** Workers write their run into the ResultsStore directory; the main process adds the finished runs to the manifest
+*** Every run is stored with the configuration key of its job (cache.configKey: parameters, seed, steps, columns,
+*** stop_when_settled and code version); jobs that are already in the manifest with the same key are skipped, so an
+*** interrupted sweep can simply be started again, and runs of another configuration under the same run id are run
+*** again (and replaced)
+*** A job that fails (an exception, or a worker process that dies) is retried up to retries times; jobs that still
+*** fail are reported on stderr and, once the pool is done, raised as a SweepError (the finished runs are kept in the
+*** store, so the sweep can be started again after the cause is fixed)
+*** With common_random_numbers, replicate r of every parameter set gets the same crop_event_seed, so the compared
+*** parameter sets see the same crop events (see ag_sim/events.py) and their differences have a lower variance
+*** With a ResultCache (see ag_sim/cache.py), jobs whose configuration was run before are copied from the cache
+*** instead of simulated, and every simulated run is added to the cache
+'''
+
+
+# All combinations of the variable parameters (like mesa's BatchRunner)
+def parameterSets(variable_params):
+    names = list(variable_params)
+    return [dict(zip(names, values)) for values in itertools.product(*(variable_params[name] for name in names))]
+
+
+def deriveSeed(base_seed, param_index, replicate):
+    return int(numpy.random.SeedSequence([base_seed, param_index, replicate]).generate_state(1)[0])
+
+
+# Seed of the crop events of a replicate, shared by all parameter sets
+def eventSeed(base_seed, replicate):
+    return int(numpy.random.SeedSequence([base_seed, replicate]).generate_state(1)[0])
+
+
+def runId(param_index, replicate):
+    return "p{:03d}-r{:03d}".format(param_index, replicate)
+
+
+COLUMNS = ("harvest_score", "total_steps_dehydrated", "total_steps_sick", "total_steps_weeds")
+
+
+# Quantile of Student's t distribution (Cornish-Fisher expansion around the normal quantile, good from 2 degrees of freedom)
+def tQuantile(p, df):
+    z = NormalDist().inv_cdf(p)
+    terms = ((z ** 3 + z) / 4,
+             (5 * z ** 5 + 16 * z ** 3 + 3 * z) / 96,
+             (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / 384,
+             (79 * z ** 9 + 776 * z ** 7 + 1482 * z ** 5 - 1920 * z ** 3 - 945 * z) / 92160)
+    return z + sum(term / df ** (power + 1) for power, term in enumerate(terms))
+
+
+class SweepError(RuntimeError):
+
+    # failures: error of every failed run, by run id; entries: manifest entries of the runs that finished
+    def __init__(self, failures, entries):
+        super().__init__("{} runs failed: {}".format(len(failures), ", ".join(sorted(failures))))
+        self.failures = failures
+        self.entries = entries
+
+
+# Model of the worker process, reset for every job instead of created again (see AgSimulator.reset)
+_workerModel = None
+
+
+# Runs a single job in a worker process and returns the manifest entry of the run
+def runJob(job):
+    global _workerModel
+    from ag_sim.model import AgSimulator
+
+    start = time.perf_counter()
+    if _workerModel is None:
+        _workerModel = AgSimulator(seed=job["seed"], **job["params"])
+    else:
+        _workerModel.reset(job["seed"], **job["params"])
+    model = _workerModel
+    entry = ResultsStore(job["store"]).write_model(model, job["steps"], job["metadata"], job["run"],
+                                                   columns=job["columns"], commit=False,
+                                                   stop_when_settled=job["stop_when_settled"])
+    entry["seconds"] = time.perf_counter() - start
+    return entry
+
+
+def printProgress(done, total, entry):
+    print("[{}/{}] {} ({:.1f}s)".format(done, total,
+                                        entry["run"], entry["seconds"]))
+
+
+def openStore(store, cache):
+    if not isinstance(store, ResultsStore):
+        store = ResultsStore(store)
+    if cache is not None and not isinstance(cache, ResultCache):
+        cache = ResultCache(cache)
+    return store, cache
+
+
+# Jobs of the given replicates of a parameter set, by run id
+def replicateJobs(store, fixed_params, variable, param_index, replicates, steps, columns, base_seed,
+                  common_random_numbers=False, stop_when_settled=False):
+    jobs = {}
+    for replicate in replicates:
+        seed = deriveSeed(base_seed, param_index, replicate)
+        run = runId(param_index, replicate)
+        jobs[run] = {"run": run, "seed": seed, "steps": steps, "store": store.path, "columns": list(columns),
+                     "stop_when_settled": stop_when_settled,
+                     "params": dict(fixed_params, **variable),
+                     "metadata": {"params": variable, "param_index": param_index, "replicate": replicate, "seed": seed}}
+        if common_random_numbers:
+            jobs[run]["params"]["crop_event_seed"] = jobs[run]["metadata"]["crop_event_seed"] = \
+                eventSeed(base_seed, replicate)
+        jobs[run]["key"] = jobs[run]["metadata"]["config"] = configKey(
+            jobs[run]["params"], seed, steps, columns, stop_when_settled)
+    return jobs
+
+
+# Runs the jobs that are not in the manifest yet with the same configuration, and returns the errors of the jobs
+# that failed, by run id
+def runJobs(store, jobs, processes, retries, progress, cache):
+    finished = {entry["run"]: entry.get("config") for entry in store.manifest()}
+    pending = {run: job for run, job in jobs.items() if finished.get(run) != job["key"]}
+    done = len(jobs) - len(pending)
+    attempts = defaultdict(int)
+    failures = {}
+
+    if cache is not None:
+        for run, job in list(pending.items()):
+            entry = cache.fetch(job["key"], store, run, job["metadata"])
+            if entry is None:
+                continue
+            entry["seconds"] = 0.0
+            store.commit(entry)
+            del pending[run]
+            done += 1
+            if progress is not None:
+                progress(done, len(jobs), entry)
+
+    # A dead worker breaks the whole pool, so the remaining jobs are resubmitted to a new pool
+    while pending:
+        with ProcessPoolExecutor(processes) as pool:
+            futures = {pool.submit(runJob, job): run for run,
+                       job in pending.items()}
+            for future in as_completed(futures):
+                run = futures[future]
+                try:
+                    entry = future.result()
+                except Exception as error:
+                    attempts[run] += 1
+                    if attempts[run] > retries:
+                        del pending[run]
+                        failures[run] = error
+                        sys.stderr.write("Run " + run + " failed: " + repr(error) + "\n")
+                    continue
+                store.commit(entry)
+                if cache is not None:
+                    cache.add(pending[run]["key"], store, entry)
+                del pending[run]
+                done += 1
+                if progress is not None:
+                    progress(done, len(jobs), entry)
+    return failures
+
+
+'''
+*** runSweep runs all jobs of a sweep and returns the manifest entries of its runs
+    Input:
+          - store: ResultsStore (or its path) the runs are written to
+          - fixed_params, variable_params: as for mesa's BatchRunner
+          - replicates: number of runs per parameter set
+          - steps: number of steps per run
+          - columns: model reporters to record
+          - processes: size of the process pool (None uses all cores)
+          - base_seed, retries, progress: see above; progress(done, total, entry) is called for every finished run
+          - cache: ResultCache (or its path), None to simulate every job
+          - common_random_numbers: see above
+          - stop_when_settled: stop simulating every run once it is settled (see ResultsStore.write_model)
+    *** Raises a SweepError if some runs failed
+'''
+
+
+def runSweep(store, fixed_params, variable_params, replicates, steps, columns=COLUMNS,
+             processes=None, base_seed=0, retries=2, progress=printProgress, cache=None, common_random_numbers=False,
+             stop_when_settled=False):
+    store, cache = openStore(store, cache)
+    jobs = {}
+    for param_index, variable in enumerate(parameterSets(variable_params)):
+        jobs.update(replicateJobs(store, fixed_params, variable, param_index, range(replicates), steps, columns,
+                                  base_seed, common_random_numbers, stop_when_settled))
+    failures = runJobs(store, jobs, processes, retries, progress, cache)
+    entries = [entry for entry in store.manifest() if entry["run"] in jobs]
+    if failures:
+        raise SweepError(failures, entries)
+    return entries
+
+
+'''
+*** runAdaptiveSweep runs replicates of every parameter set until the confidence intervals of the final values of
+    all columns are narrow enough, or max_replicates is reached; noisy parameter sets get more replicates
+    Input (like runSweep, and):
+          - widths: maximum width of the confidence interval per column; a column without a width uses
+            relative_width times the absolute value of its mean
+          - confidence: confidence level of the intervals (Student's t)
+          - min_replicates, max_replicates: bounds of the number of replicates per parameter set
+    *** All parameter sets start with min_replicates; after every round, the sets that are not narrow enough get the
+        number of replicates their current variance asks for (at most doubling, up to max_replicates)
+    *** Replicates have the same run ids and seeds as in runSweep, so both share the store and the cache
+    *** Raises a SweepError after the first round in which some runs failed
+    Output:
+          - manifest entries of the runs
+          - DataFrame with the number of replicates, mean and interval width of every column per parameter set
+'''
+
+
+def runAdaptiveSweep(store, fixed_params, variable_params, steps, columns=COLUMNS, widths=None, relative_width=0.05,
+                     confidence=0.95, min_replicates=3, max_replicates=30, processes=None, base_seed=0, retries=2,
+                     progress=printProgress, cache=None, common_random_numbers=False, stop_when_settled=False):
+    store, cache = openStore(store, cache)
+    widths = widths or {}
+    sets = parameterSets(variable_params)
+    wanted = [min_replicates] * len(sets)
+    finished = [0] * len(sets)
+    runs = {}
+
+    while any(finished[index] < wanted[index] for index in range(len(sets))):
+        jobs = {}
+        for param_index, variable in enumerate(sets):
+            jobs.update(replicateJobs(store, fixed_params, variable, param_index,
+                                      range(finished[param_index], wanted[param_index]), steps, columns, base_seed,
+                                      common_random_numbers, stop_when_settled))
+        failures = runJobs(store, jobs, processes, retries, progress, cache)
+        runs.update(jobs)
+        if failures:
+            raise SweepError(failures, [entry for entry in store.manifest() if entry["run"] in runs])
+
+        entries = {entry["run"]: entry for entry in store.manifest() if entry["run"] in runs}
+        rows = list()
+        for param_index, variable in enumerate(sets):
+            finished[param_index] = wanted[param_index]
+            finals = numpy.array([[store.column(run, column)[-1] for column in columns] for run in entries
+                                  if entries[run]["param_index"] == param_index], dtype=float).reshape(-1, len(columns))
+            count = len(finals)
+            mean = finals.mean(axis=0) if count > 0 else numpy.full(len(columns), numpy.nan)
+            std = finals.std(axis=0, ddof=1) if count > 1 else numpy.full(len(columns), numpy.inf)
+            critical = tQuantile((1 + confidence) / 2, max(count - 1, 1))
+            width = 2 * critical * std / numpy.sqrt(max(count, 1))
+            target = numpy.array([widths.get(column, relative_width * abs(value))
+                                  for column, value in zip(columns, mean)])
+            if count >= min_replicates and numpy.all(width <= target):
+                narrow = True
+            else:
+                narrow = False
+                # Replicates needed for the widest column, with the current estimate of its variance
+                with numpy.errstate(divide="ignore", invalid="ignore"):
+                    needed = numpy.nanmax(numpy.where(target > 0, (2 * critical * std / target) ** 2, numpy.inf))
+                wanted[param_index] = int(min(max_replicates, 2 * count, max(count + 1, numpy.ceil(needed))))
+            rows.append(dict(variable, replicates=count, narrow=narrow,
+                             **{column + "_mean": value for column, value in zip(columns, mean)},
+                             **{column + "_width": value for column, value in zip(columns, width)}))
+
+    import pandas as pd
+
+    return list(entries.values()), pd.DataFrame(rows)
@@ -0,0 +1,96 @@
+import numpy
+from ag_sim.states import STATE_NAMES, DRY_STATES, WEEDS_STATES, SICK_STATES, stateMask
+
+'''
+*** Target selection engine for the ActiveAgents
+*** Candidates are given as an array of scores; a lower score means a better target
+*** Only the indices of the requested targets are returned, so the caller materializes just what it uses
+
+*** Ties are ranked with the later candidate first, which is the order the old
+*** prioritizeQueue insertion sort produced (a new element was inserted in front of equal scores)
+'''
+
+
+'''
+*** rankTargets returns the indices of the k best (lowest) scores in ranked order
+    Input:
+          - scores: sequence of numbers, one per candidate
+          - k: number of targets needed (None ranks all candidates)
+    Output:
+          - numpy array of candidate indices, best first
+'''
+
+
+def rankTargets(scores, k=None):
+    scores = numpy.asarray(scores)
+    count = len(scores)
+    if k is None or k >= count:
+        return numpy.lexsort((-numpy.arange(count), scores))
+    if k <= 0:
+        return numpy.zeros(0, dtype=int)
+
+    # Partition around the k-th score, then rank only the selected candidates
+    kth = numpy.partition(scores, k - 1)[k - 1]
+    better = numpy.flatnonzero(scores < kth)
+    ties = numpy.flatnonzero(scores == kth)[::-1][:k - len(better)]
+    selected = numpy.concatenate((better, ties))
+    return selected[numpy.lexsort((-selected, scores[selected]))]
+
+
+'''
+*** Vectorized scoring of the fields for an ActiveAgent
+*** fieldUrgency computes for every field at once what ActiveAgent.heuristic used to compute per field:
+                - start, plowed and harvestable fields score their road distance to the agent
+                - dry, weeds and sick fields score (time in state + distance) / maximum steps in that state,
+                  multiplied by (1 - taken); fields that would be lost before the agent arrives (> 1) score 999
+                - all other fields score 0
+'''
+
+DISTANCE_MASK = stateMask(("start", "plowed", "harvestable"))
+URGENCY_MASK = stateMask(DRY_STATES + WEEDS_STATES + SICK_STATES)
+
+
+# Array over the state codes with the maximum number of steps a crop survives in each state
+def stateLimits(max_steps_dehydrated, max_steps_weeds, max_steps_sick):
+    limits = numpy.ones(len(STATE_NAMES))
+    limits[stateMask(DRY_STATES)] = max_steps_dehydrated
+    limits[stateMask(WEEDS_STATES)] = max_steps_weeds
+    limits[stateMask(SICK_STATES)] = max_steps_sick
+    return limits
+
+
+# Array version of agents.distance: road distance from every position in positions (n x 2) to pos
+# pos may also be an m x 2 array of positions, the result is then an m x n distance matrix
+# headlands are the road rows of the layout (see ag_sim/layout.py)
+def roadDistance(positions, pos, headlands=(0, 49)):
+    pos = numpy.asarray(pos)
+    x = pos[..., 0, None]
+    y = pos[..., 1, None]
+    columns = numpy.abs(positions[:, 0] - x)
+    direct = columns + numpy.abs(positions[:, 1] - y)
+    viaHeadland = None
+    for row in headlands:
+        distance = columns + numpy.abs(row - positions[:, 1]) + numpy.abs(row - y)
+        viaHeadland = distance if viaHeadland is None else numpy.minimum(viaHeadland, distance)
+    return numpy.where(columns == 1, direct, viaHeadland)
+
+
+'''
+*** fieldUrgency returns the score of every field for an agent at pos
+    Input:
+          - codes, times, taken: state code, time at current state and taken flag per field
+          - positions: n x 2 array with the field positions
+          - pos: position of the agent (or m x 2 array with the positions of m agents)
+          - limits: result of stateLimits
+          - headlands: the road rows of the layout
+    Output:
+          - numpy array of scores (lower is better), m x n when scoring for m agents
+'''
+
+
+def fieldUrgency(codes, times, taken, positions, pos, limits, headlands=(0, 49)):
+    distances = roadDistance(positions, pos, headlands)
+    urgency = (times + distances) / limits[codes] * (1 - taken)
+    urgency = numpy.where(urgency > 1, 999, urgency)
+    return numpy.where(URGENCY_MASK[codes], urgency,
+                       numpy.where(DISTANCE_MASK[codes], distances, 0))
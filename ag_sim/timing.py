@@ -0,0 +1,101 @@
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+
+'''
+*** StageTimer records wall time and call counts while the model is running
+*** Measurements are grouped in sections:
+                                        - stage: the phases of AgSimulator.step and ActivePassiveAgentActivation.step
+                                        - agent: time spent in step/advance per agent class
+                                        - function: named hot functions wrapped through StageTimer.wrap
+*** Function times are inclusive, so they overlap with the stage and agent times they are called from
+*** A model created without the "timing" parameter has no StageTimer; its step runs the same code with NO_TIMER,
+*** whose measure does nothing
+'''
+
+
+class StageTimer():
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+
+    # Add a measurement to the given section
+    def add(self, section, name, seconds, calls=1):
+        key = (section, name)
+        self.seconds[key] += seconds
+        self.calls[key] += calls
+
+    '''
+    *** wrap replaces obj.name with a version that records its wall time and call count
+        Input:
+              - object (instance) owning the function
+              - name of the function to time
+    '''
+
+    def wrap(self, obj, name, section="function"):
+        func = getattr(obj, name)
+        timer = self
+
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timer.add(section, name, perf_counter() - start)
+
+        setattr(obj, name, timed)
+
+    # Context manager that adds the wall time of its block to the given section
+    @contextmanager
+    def measure(self, section, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(section, name, perf_counter() - start)
+
+    # Calls stage ("step" or "advance") of every agent, timed per agent class (see ActivePassiveAgentActivation.step)
+    def callAgents(self, agents, stage):
+        seconds = defaultdict(float)
+        calls = defaultdict(int)
+        for agent in agents:
+            start = perf_counter()
+            getattr(agent, stage)()
+            name = type(agent).__name__ + "." + stage
+            seconds[name] += perf_counter() - start
+            calls[name] += 1
+        for name in seconds:
+            self.add("agent", name, seconds[name], calls[name])
+
+    # Returns {"section:name": (seconds, calls)}; used as the "timing" model reporter
+    def report(self):
+        return {section + ":" + name: (self.seconds[(section, name)], self.calls[(section, name)])
+                for section, name in self.seconds}
+
+    # Human readable table, ordered by section and then by time spent
+    def summary(self):
+        lines = ["{:<10} {:<32} {:>10} {:>10} {:>12}".format(
+            "section", "name", "seconds", "calls", "us/call")]
+        for section, name in sorted(self.seconds, key=lambda key: (key[0], -self.seconds[key])):
+            seconds = self.seconds[(section, name)]
+            calls = self.calls[(section, name)]
+            lines.append("{:<10} {:<32} {:>10.3f} {:>10} {:>12.1f}".format(
+                section, name, seconds, calls, 1e6 * seconds / max(calls, 1)))
+        return "\n".join(lines)
+
+
+# Stand-in for a StageTimer when timing is off
+class NullTimer():
+
+    _nothing = nullcontext()
+
+    def measure(self, section, name):
+        return self._nothing
+
+    def callAgents(self, agents, stage):
+        for agent in agents:
+            getattr(agent, stage)()
+
+
+NO_TIMER = NullTimer()
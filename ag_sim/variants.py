@@ -0,0 +1,95 @@
+import multiprocessing
+from ag_sim.checkpoint import loadCheckpoint, snapshot
+from ag_sim.results import ResultsStore
+from ag_sim.sweep import deriveSeed
+
+'''
+*** Variants of a simulation forked from one snapshot
+*** The snapshot is the state of an AgSimulator at some step: a model (which is snapshotted first), the bytes of
+*** checkpoint.snapshot or the path of a checkpoint file (see ag_sim/checkpoint.py)
+*** Every variant is restored from the snapshot with its own parameter overrides and its own random stream, derived
+*** from base_seed and the index of the variant; with base_seed None all variants continue the saved random stream
+*** runVariants can run the variants in worker processes started with fork: the snapshot is read once by the main
+*** process and shared copy-on-write with the workers, instead of being sent to every worker
+'''
+
+
+def variantSeed(base_seed, index):
+    return None if base_seed is None else deriveSeed(base_seed, index, 0)
+
+
+# The snapshot as bytes
+def readSnapshot(source):
+    if isinstance(source, bytes):
+        return source
+    if isinstance(source, str):
+        with open(source, "rb") as file:
+            return file.read()
+    return snapshot(source)
+
+
+# One model per variant, restored in this process
+def forkVariants(source, variants, base_seed=0):
+    source = readSnapshot(source)
+    return [loadCheckpoint(source, overrides, variantSeed(base_seed, index))
+            for index, overrides in enumerate(variants)]
+
+
+# Snapshot shared with the forked workers of runVariants
+_source = None
+
+
+# Runs a single variant (in a worker or in the main process)
+def runVariant(job):
+    model = loadCheckpoint(_source, job["overrides"], job["seed"])
+    if job["store"] is None:
+        for _ in range(model.schedule.steps, job["steps"]):
+            model.step()
+        return model.datacollector.get_model_vars_dataframe()
+    metadata = {"overrides": job["overrides"], "variant": job["variant"], "seed": job["seed"],
+                "start": model.schedule.steps}
+    return ResultsStore(job["store"]).write_model(model, max(job["steps"] - model.schedule.steps, 0), metadata,
+                                                  "v{:03d}".format(job["variant"]), columns=job["columns"], commit=False)
+
+
+'''
+*** runVariants runs every variant from the snapshot until step steps
+    Input:
+          - source: the snapshot (see above)
+          - variants: list of parameter overrides (dicts), one per variant
+          - steps: step the variants run until
+    Optional:
+          - store: ResultsStore (or its path); every variant is written there as run "v<index>" from the snapshot on
+          - columns: model reporters recorded in the store
+          - base_seed: see above
+          - processes: number of worker processes (None uses all cores, 1 runs in this process); workers are only
+            used where processes can be forked
+    Output:
+          - the model data of every variant (its model vars DataFrame, including the steps before the snapshot),
+            or its manifest entry when a store is given
+'''
+
+
+def runVariants(source, variants, steps, store=None, columns=None, base_seed=0, processes=None):
+    global _source
+    if store is not None and not isinstance(store, ResultsStore):
+        store = ResultsStore(store)
+
+    jobs = [{"variant": index, "overrides": dict(overrides), "seed": variantSeed(base_seed, index), "steps": steps,
+             "store": store.path if store is not None else None, "columns": columns}
+            for index, overrides in enumerate(variants)]
+
+    _source = readSnapshot(source)
+    try:
+        if processes == 1 or "fork" not in multiprocessing.get_all_start_methods():
+            results = [runVariant(job) for job in jobs]
+        else:
+            with multiprocessing.get_context("fork").Pool(processes) as pool:
+                results = pool.map(runVariant, jobs)
+    finally:
+        _source = None
+
+    if store is not None:
+        for entry in results:
+            store.commit(entry)
+    return results
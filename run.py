@@ -1,4 +1,4 @@
-from ag_sim.server import server
+from ag_sim.server import server, createReplayServer
 import os
 import sys
 # To work on linux and Windows
@@ -7,4 +7,7 @@ sys.setrecursionlimit(915000)
 if os.name == 'nt':
     import asyncio
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+# python run.py <replay log> plays a recorded run (see ag_sim/replay.py) instead of simulating
+if len(sys.argv) > 1:
+    server = createReplayServer(sys.argv[1])
 server.launch()
@@ -4,31 +4,9 @@ The file run_experiments.py is used in order to quickly run a lot of experiments
 with the model.
 '''
 # Imports
-from collections import defaultdict
-from ag_sim.model import AgSimulator
-from ag_sim.agents import PassiveAgent, ActiveAgent, PassiveAgentPerception, ActiveAgentPlanning, PassiveAgentStateMachine, FarmAgent
-from mesa.datacollection import DataCollector
-from mesa.batchrunner import BatchRunner
-
-import matplotlib.pyplot as plt
-
-
-'''
-*** The get_harvest_score function returns the current harvest score of the model.
-'''
-
-
-def get_harvest_score(model):
-    return model.harvest_score
-
-def get_total_steps_dehydrated( model):
-    return model.total_steps_dehydrated
-
-def get_total_steps_sick(model):
-    return model.total_steps_sick
-
-def get_total_steps_weeds(model):
-    return model.total_steps_weeds
+from ag_sim.results import ResultsStore
+from ag_sim.sweep import runAdaptiveSweep
+import pandas as pd
 
 
 '''
@@ -101,33 +79,24 @@ variable_params = set_variable_params()
 # Set all parameters that are not varied and thus fixed for all experiments
 fixed_params = set_fixed_params()
 
-# Prepare the batch of experiments
-batch_run = BatchRunner(AgSimulator,
-                        variable_params,
-                        fixed_params,
-                        iterations=1,
-                        max_steps=6500,
-                        model_reporters={
-                            "harvest_score": get_harvest_score,
-                            "total_steps_dehydrated": get_total_steps_dehydrated,
-                            "total_steps_sick": get_total_steps_sick,
-                            "total_steps_weeds": get_total_steps_weeds,
-                        },
-                        agent_reporters={"pos": "pos"}
-                        )
-
-# Run the batch of experiments
-batch_run.run_all()
-
-# %%
-# Get all agent data
-# agent_data = batch_run.get_agent_vars_dataframe()
-# print(agent_data.head())
-
-# Get all model data
-model_data = batch_run.get_model_vars_dataframe()
-interesting_columns = ["com_protocol", "active_agents", "harvest_score", "total_steps_dehydrated", "total_steps_sick", "total_steps_weeds"]
-print(model_data[interesting_columns])
+# Run the batch of experiments on all cores; every run is streamed to the results store (see ag_sim/sweep.py)
+# Runs already in the store are skipped, so an interrupted batch can be started again,
+# and runs of a configuration that was run before (with the same code) are copied from the cache (see ag_sim/cache.py)
+# Every parameter set gets replicates until the 95% confidence intervals of the final scores are within 5% of their mean
+# (at most 10 replicates); use runSweep for a fixed number of replicates
+if __name__ == "__main__":
+    store = ResultsStore("results_batch")
+    runs, replicate_summary = runAdaptiveSweep(store, fixed_params, variable_params, steps=6500, relative_width=0.05,
+                                               max_replicates=10, base_seed=0, cache="results_cache")
+    print(replicate_summary)
+
+    # %%
+    # Get the final model data of every run
+    model_data = pd.DataFrame([dict(entry["params"], com_protocol=fixed_params["com_protocol"],
+                                    **{column: store.column(entry["run"], column)[-1] for column in entry["columns"]})
+                               for entry in runs])
+    interesting_columns = ["com_protocol", "active_agents", "harvest_score", "total_steps_dehydrated", "total_steps_sick", "total_steps_weeds"]
+    print(model_data[interesting_columns])
 
 # plt.scatter(model_data.active_agents, model_data.harvest_score)
 
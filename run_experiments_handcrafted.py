@@ -4,13 +4,10 @@ with the model.
 '''
 #%%
 # Imports
-from collections import defaultdict
 from ag_sim.model import AgSimulator
-from ag_sim.agents import PassiveAgent, ActiveAgent, PassiveAgentPerception, ActiveAgentPlanning, PassiveAgentStateMachine, FarmAgent
+from ag_sim.results import ResultsStore
+from ag_sim.aggregate import StreamingAggregate
 import pandas as pd
-import os
-import numpy as np
-import matplotlib.pyplot as plt
 '''
 Function set_fixed_params sets all the fixed model parameters for the experiments. 
 Parameters are only set here if they have not been set as a variable parameter.
@@ -57,9 +54,13 @@ def set_model_params():
 
 '''
 Function run_experiment runs a single experiment for a given number of iterations
+The results of every iteration are streamed to the ResultsStore (see ag_sim/results.py)
+Iteration i of experiment e is stored as run "e<e>-it<i>", so running the script again overwrites the old runs
+Set replay_interval to record a replay log of every run with a keyframe every replay_interval steps (see ag_sim/replay.py)
 '''
-model_results = []
-def run_experiment(num_iterations, max_steps, exp_number=0):
+columns = ["harvest_score", "total_steps_dehydrated", "total_steps_sick", "total_steps_weeds"]
+replay_interval = None # e.g. 100 to record replay logs
+def run_experiment(store, num_iterations, max_steps, exp_number=0):
 
     # Set this experiment's model parameters and create the model
     model_params = set_model_params()
@@ -69,41 +70,26 @@ def run_experiment(num_iterations, max_steps, exp_number=0):
         print("**************** ITERATION " + str(i) + " of EXP " + str(exp_number) + " ****************")
 
         model = AgSimulator(**model_params)
-        model.run_model(max_steps) # Run the model for at most max_steps
+        store.write_model(model, max_steps, {"params": model_params, "iteration": i, "experiment": exp_number},
+                          "e{:03d}-it{:03d}".format(exp_number, i), columns=columns, replay_interval=replay_interval) # Run the model for at most max_steps
 
-        agent_coords = model.datacollector.get_agent_vars_dataframe()
-        model_results.append(model.datacollector.get_model_vars_dataframe())
-
-    # TODO: Return the collected data from this experiment
-    return model_results
+    return store.manifest()
 
 
 # Use the line below to run a single experiment
-output = run_experiment(10, 6500) #comment this out when loading a outfile_ file to only plot.
-
-#you have to use these two line or it given an error 
-np.save('outfile', output)
-output1 =  np.load('outfile.npy') # there are 3 outfile_ files for the three protocols which you can load
-
-
-results = [[0 for i in range(4)] for j in range(6500)]
-for i in range(10):
-    for j in range(6500):
-        if j == 0:
-            pass
-        else:
-            results[j][0] = results[j][0] + output1[i][j][0]
-            results[j][1] = results[j][1] + output1[i][j][1]
-            results[j][2] = results[j][2] + output1[i][j][2]
-            results[j][3] = results[j][3] + output1[i][j][3]
+store = ResultsStore('results_ccp_12')
+run_experiment(store, 10, 6500) #comment this out when loading an existing results_ store to only plot.
+output = store.manifest()
 
-for i in range(4):
-    for j in range(6500):
-        results[j][i] = results[j][i]/10
+# Aggregate the iterations per step (mean, variance and quantiles), one memory-mapped chunk at a time
+aggregate = StreamingAggregate(6500, columns)
+for entry in output:
+    aggregate.update_from_store(store, entry["run"])
 
-df = pd.DataFrame(data=results,  columns=["Harvest_score", "Steps_dehydrated","Steps_sick", "Steps_weed"])
+df = pd.DataFrame(data=aggregate.mean,  columns=["Harvest_score", "Steps_dehydrated","Steps_sick", "Steps_weed"])
 
 df.to_pickle('ccp_12')
+aggregate.summary().to_pickle('ccp_12_summary')
 
 # df.plot()	
     # plt.show()
@@ -0,0 +1,8 @@
+'''
+The file run_headless.py runs the model from the command line, without visualization
+(see ag_sim/cli.py, or python run_headless.py --help)
+'''
+from ag_sim.cli import main
+
+if __name__ == "__main__":
+    main()